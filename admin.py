@@ -1,58 +1,266 @@
-from aiogram import Dispatcher, types
-from aiogram.filters import Command
+from aiogram import Bot, Dispatcher, types
+from aiogram.filters import Command, CommandObject
 from config import ADMIN_ID
-from database import get_user
-import sqlite3
+from database import (cache_stats, audit_stats, get_stats, recompute_stats, page_users, page_transactions,
+                      USER_COLUMNS, TRANSACTION_COLUMNS)
+from datetime import date, timedelta
+import asyncio
+import csv
+import metrics
+from broadcast import prepare_broadcast, start_broadcast, cancel_broadcast
+import os
+import tempfile
 import logging
 
 logger = logging.getLogger(__name__)
 
+def _format_stats(stats):
+    return (f"📊 Admin Panel\nUsers: {int(stats.get('user_count', 0))}"
+            f"\nTotal Deposits: ${stats.get('total_deposits', 0)}"
+            f"\nPending Withdrawals: ${stats.get('pending_withdrawals', 0)}")
+
+PAGE_SIZE = 10
+BROADCAST_USAGE = "Usage: /broadcast <text> or /broadcast cancel <id>"
+EXPORT_CHUNK = 1000
+
+def _parse_filters(args):
+    """
+    Разобрать фильтры вида "min=100 blocked since=2026-01-01 until=2026-01-31".
+    Даты включительные; until превращается в начало следующего дня.
+    """
+    filters = {}
+    for arg in (args or "").split():
+        key, _, value = arg.partition("=")
+        if key == "min":
+            filters["min"] = float(value)
+        elif key == "blocked":
+            filters["blocked"] = True
+        elif key in ("since", "until"):
+            filters[key] = date.fromisoformat(value)
+        else:
+            raise ValueError(f"unknown filter: {arg}")
+    return filters
+
+def _query_args(filters):
+    until = filters.get("until")
+    return {
+        "since": str(filters["since"]) if filters.get("since") else None,
+        "until": str(until + timedelta(days=1)) if until else None,
+    }
+
+# callback_data ограничена 64 байтами, поэтому курсор и фильтры
+# упаковываются в "<prefix>:<after>:<min>:<blocked>:<since>:<until>"
+def _pack(prefix, after, filters):
+    since, until = filters.get("since"), filters.get("until")
+    return ":".join([
+        prefix, str(after),
+        f"{filters['min']:g}" if "min" in filters else "",
+        "1" if filters.get("blocked") else "",
+        since.strftime("%Y%m%d") if since else "",
+        until.strftime("%Y%m%d") if until else "",
+    ])
+
+def _unpack(data):
+    parts = data.split(":")
+    if len(parts) == 1:
+        return 0, {}
+    _, after, min_value, blocked, since, until = parts
+    filters = {}
+    if min_value:
+        filters["min"] = float(min_value)
+    if blocked:
+        filters["blocked"] = True
+    if since:
+        filters["since"] = date(int(since[:4]), int(since[4:6]), int(since[6:]))
+    if until:
+        filters["until"] = date(int(until[:4]), int(until[4:6]), int(until[6:]))
+    return int(after), filters
+
+def _fetch_users(after, filters, limit):
+    return page_users(after, limit, min_balance=filters.get("min"), blocked=filters.get("blocked"),
+                      **_query_args(filters))
+
+def _fetch_withdrawals(after, filters, limit):
+    return page_transactions(after, limit, type="withdraw", status="pending", min_amount=filters.get("min"),
+                             **_query_args(filters))
+
+def _fetch_transactions(after, filters, limit):
+    return page_transactions(after, limit, min_amount=filters.get("min"), **_query_args(filters))
+
+async def _render_page(prefix, after, filters):
+    if prefix == "admin_users":
+        rows = await _fetch_users(after, filters, PAGE_SIZE + 1)
+        title = "👥 Users:"
+        lines = [f"ID: {u[0]}, Balance: ${u[3]}" + (" 🚫" if u[4] else "") for u in rows[:PAGE_SIZE]]
+    else:
+        rows = await _fetch_withdrawals(after, filters, PAGE_SIZE + 1)
+        title = "📤 Pending Withdrawals:"
+        lines = [f"#{w[0]} ID: {w[1]}, Amount: ${w[2]}" for w in rows[:PAGE_SIZE]]
+    buttons = []
+    if after:
+        buttons.append(types.InlineKeyboardButton(text="⏮ First", callback_data=_pack(prefix, 0, filters)))
+    if len(rows) > PAGE_SIZE:
+        buttons.append(types.InlineKeyboardButton(text="Next ▶️", callback_data=_pack(prefix, rows[PAGE_SIZE - 1][0], filters)))
+    text = "\n".join([title] + lines) if lines else title + "\n—"
+    return text, types.InlineKeyboardMarkup(inline_keyboard=[buttons] if buttons else [])
+
 def register_admin_handlers(dp: Dispatcher):
     @dp.message(Command("admin"))
-    async def admin_panel(message: types.Message):
+    async def admin_panel(message: types.Message, update_queue=None):
         logger.info(f"Admin panel accessed by user {message.from_user.id}")
         if message.from_user.id != ADMIN_ID:
             logger.warning(f"Unauthorized access to admin panel by user {message.from_user.id}")
             return
-        conn = sqlite3.connect("betsmilebot.db")
-        cursor = conn.cursor()
-        cursor.execute("SELECT COUNT(*) FROM users")
-        user_count = cursor.fetchone()[0]
-        cursor.execute("SELECT SUM(amount) FROM transactions WHERE type = 'deposit' AND status = 'completed'")
-        total_deposits = cursor.fetchone()[0] or 0
-        cursor.execute("SELECT SUM(amount) FROM transactions WHERE type = 'withdraw' AND status = 'pending'")
-        pending_withdrawals = cursor.fetchone()[0] or 0
-        conn.close()
-        
-        text = f"📊 Admin Panel\nUsers: {user_count}\nTotal Deposits: ${total_deposits}\nPending Withdrawals: ${pending_withdrawals}"
+        text = _format_stats(await get_stats())
+        stats = cache_stats()
+        text += f"\nUser cache: {stats['hits']} hits / {stats['misses']} misses ({stats['size']} cached)"
+        audit = audit_stats()
+        text += f"\nAudit queue: {audit['depth']} pending, last flush {audit['last_flush_ms']:.1f} ms"
+        if update_queue is not None:
+            queues = update_queue.queue_stats()
+            text += (f"\nUpdate queues: {queues['waiting']} waiting, longest {queues['longest_queue']}, "
+                     f"avg wait {queues['avg_wait_ms']:.1f} ms, max {queues['max_wait_ms']:.1f} ms")
         keyboard = types.InlineKeyboardMarkup(inline_keyboard=[
             [types.InlineKeyboardButton(text="View Users", callback_data="admin_users"),
-             types.InlineKeyboardButton(text="Pending Withdrawals", callback_data="admin_withdrawals")]
+             types.InlineKeyboardButton(text="Pending Withdrawals", callback_data="admin_withdrawals")],
+            [types.InlineKeyboardButton(text="Stop Profiler" if metrics.profiler.running else "Start Profiler",
+                                        callback_data="admin_profile")]
         ])
         await message.answer(text, reply_markup=keyboard)
 
-    @dp.callback_query(lambda c: c.data == "admin_users")
-    async def admin_users(callback: types.CallbackQuery):
-        logger.info(f"Admin users accessed by user {callback.from_user.id}")
+    @dp.callback_query(lambda c: c.data == "admin_profile")
+    async def admin_profile(callback: types.CallbackQuery):
+        logger.info(f"Profiler toggled by user {callback.from_user.id}")
         if callback.from_user.id != ADMIN_ID:
             return
-        conn = sqlite3.connect("betsmilebot.db")
-        cursor = conn.cursor()
-        cursor.execute("SELECT telegram_id, real_balance FROM users LIMIT 5")
-        users = cursor.fetchall()
-        conn.close()
-        text = "👥 Users:\n" + "\n".join([f"ID: {u[0]}, Balance: ${u[1]}" for u in users])
-        await callback.message.edit_text(text)
-
-    @dp.callback_query(lambda c: c.data == "admin_withdrawals")
-    async def admin_withdrawals(callback: types.CallbackQuery):
-        logger.info(f"Admin withdrawals accessed by user {callback.from_user.id}")
+        if not metrics.profiler.running:
+            metrics.profiler.start()
+            await callback.answer("Profiler started")
+            return
+        stacks = await asyncio.to_thread(metrics.profiler.stop)
+        await callback.answer("Profiler stopped")
+        if not stacks:
+            await callback.message.answer("Profiler collected no samples")
+            return
+        # Формат collapsed stacks: открывается в speedscope или flamegraph.pl
+        samples = sum(metrics.profiler.samples.values())
+        await callback.message.answer_document(
+            types.BufferedInputFile(stacks.encode(), filename=f"profile_{date.today()}.txt"),
+            caption=f"{samples} samples"
+        )
+
+    @dp.message(Command("recompute_stats"))
+    async def admin_recompute_stats(message: types.Message):
+        logger.info(f"Stats recompute requested by user {message.from_user.id}")
+        if message.from_user.id != ADMIN_ID:
+            return
+        before = await get_stats()
+        after = await recompute_stats()
+        drift = {key: after[key] - before.get(key, 0) for key in after if after[key] != before.get(key, 0)}
+        if drift:
+            logger.warning(f"Admin stats drift corrected: {drift}")
+        await message.answer(_format_stats(after) + f"\nDrift: {drift or 'none'}")
+
+    @dp.callback_query(lambda c: c.data.startswith(("admin_users", "admin_withdrawals")))
+    async def admin_browse(callback: types.CallbackQuery):
+        logger.info(f"Admin browse {callback.data} by user {callback.from_user.id}")
         if callback.from_user.id != ADMIN_ID:
             return
-        conn = sqlite3.connect("betsmilebot.db")
-        cursor = conn.cursor()
-        cursor.execute("SELECT telegram_id, amount FROM transactions WHERE type = 'withdraw' AND status = 'pending' LIMIT 5")
-        withdrawals = cursor.fetchall()
-        conn.close()
-        text = "📤 Pending Withdrawals:\n" + "\n".join([f"ID: {w[0]}, Amount: ${w[1]}" for w in withdrawals])
-        await callback.message.edit_text(text)
+        after, filters = _unpack(callback.data)
+        text, keyboard = await _render_page(callback.data.split(":")[0], after, filters)
+        await callback.message.edit_text(text, reply_markup=keyboard)
+
+    @dp.message(Command("users", "withdrawals"))
+    async def admin_browse_command(message: types.Message, command: CommandObject):
+        logger.info(f"Admin /{command.command} {command.args} by user {message.from_user.id}")
+        if message.from_user.id != ADMIN_ID:
+            return
+        try:
+            filters = _parse_filters(command.args)
+        except ValueError as e:
+            await message.answer(f"⚠️ {e}\nUsage: /{command.command} [min=100] [blocked] [since=YYYY-MM-DD] [until=YYYY-MM-DD]")
+            return
+        text, keyboard = await _render_page(f"admin_{command.command}", 0, filters)
+        await message.answer(text, reply_markup=keyboard)
+
+    @dp.message(Command("export"))
+    async def admin_export(message: types.Message, command: CommandObject):
+        logger.info(f"Admin export {command.args} by user {message.from_user.id}")
+        if message.from_user.id != ADMIN_ID:
+            return
+        kind, _, args = (command.args or "").partition(" ")
+        sources = {
+            "users": (_fetch_users, USER_COLUMNS),
+            "withdrawals": (_fetch_withdrawals, TRANSACTION_COLUMNS),
+            "transactions": (_fetch_transactions, TRANSACTION_COLUMNS),
+        }
+        try:
+            fetch, columns = sources[kind]
+            filters = _parse_filters(args)
+        except (KeyError, ValueError):
+            await message.answer("Usage: /export users|withdrawals|transactions [min=100] [blocked] "
+                                 "[since=YYYY-MM-DD] [until=YYYY-MM-DD]")
+            return
+
+        # Таблица выгружается кусками по EXPORT_CHUNK строк во временный файл,
+        # в памяти одновременно держится только один кусок
+        fd, path = tempfile.mkstemp(suffix=".csv")
+        try:
+            rows_written = 0
+            with os.fdopen(fd, "w", newline="", encoding="utf-8") as file:
+                writer = csv.writer(file)
+                writer.writerow(columns)
+                after = 0
+                while True:
+                    rows = await fetch(after, filters, EXPORT_CHUNK)
+                    if not rows:
+                        break
+                    await asyncio.to_thread(writer.writerows, rows)
+                    rows_written += len(rows)
+                    after = rows[-1][0]
+            await message.answer_document(types.FSInputFile(path, filename=f"{kind}_{date.today()}.csv"),
+                                          caption=f"{kind}: {rows_written} rows")
+        finally:
+            os.remove(path)
+
+    @dp.message(Command("broadcast"))
+    async def admin_broadcast(message: types.Message, command: CommandObject, bot: Bot):
+        logger.info(f"Admin broadcast command by user {message.from_user.id}")
+        if message.from_user.id != ADMIN_ID:
+            return
+        action, _, rest = (command.args or "").partition(" ")
+        if action == "cancel":
+            # Любое «cancel …» — только отмена: опечатка в id не должна уйти рассылкой
+            if not rest.strip().isdigit():
+                await message.answer(BROADCAST_USAGE)
+            elif not await cancel_broadcast(bot, int(rest)):
+                await message.answer(f"No such broadcast: #{int(rest)}")
+            return
+        if not command.args:
+            await message.answer(BROADCAST_USAGE)
+            return
+        # Рассылка необратима: сначала предпросмотр и число получателей
+        broadcast_id, total = await prepare_broadcast(command.args, message.chat.id)
+        logger.info(f"Broadcast #{broadcast_id} drafted by user {message.from_user.id}")
+        keyboard = types.InlineKeyboardMarkup(inline_keyboard=[[
+            types.InlineKeyboardButton(text="📣 Send", callback_data=f"admin_broadcast_send:{broadcast_id}"),
+            types.InlineKeyboardButton(text="✖️ Cancel", callback_data=f"admin_broadcast_drop:{broadcast_id}"),
+        ]])
+        await message.answer(f"📣 Broadcast #{broadcast_id} preview, {total} recipients:\n\n{command.args}",
+                             reply_markup=keyboard)
+
+    @dp.callback_query(lambda c: c.data.startswith(("admin_broadcast_send:", "admin_broadcast_drop:")))
+    async def admin_broadcast_confirm(callback: types.CallbackQuery, bot: Bot):
+        logger.info(f"Admin {callback.data} by user {callback.from_user.id}")
+        if callback.from_user.id != ADMIN_ID:
+            return
+        action, _, broadcast_id = callback.data.partition(":")
+        await callback.message.edit_reply_markup(reply_markup=None)
+        if action == "admin_broadcast_drop":
+            await cancel_broadcast(bot, int(broadcast_id))
+        elif not await start_broadcast(bot, int(broadcast_id)):
+            await callback.answer(f"Broadcast #{broadcast_id} is no longer a draft")
+            return
+        logger.info(f"Broadcast #{broadcast_id} {'started' if action == 'admin_broadcast_send' else 'dropped'} "
+                    f"by user {callback.from_user.id}")
+        await callback.answer()
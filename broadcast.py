@@ -0,0 +1,172 @@
+import asyncio
+import time
+from aiogram import Bot
+from aiogram.exceptions import TelegramRetryAfter, TelegramForbiddenError, TelegramAPIError
+from database import (create_broadcast, confirm_broadcast, set_broadcast_message, get_broadcast,
+                      get_running_broadcasts, claim_broadcast_batch, record_deliveries, finish_broadcast)
+from config import BROADCAST_RATE, BROADCAST_BATCH_SIZE, BROADCAST_CONCURRENCY, BROADCAST_PROGRESS_INTERVAL
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Сколько раз повторять отправку одному получателю после RetryAfter
+MAX_RETRIES = 5
+
+class TokenBucket:
+    """
+    Общий для всех отправок лимит rate сообщений в секунду. Ожидающие
+    обслуживаются по очереди; pause() останавливает выдачу целиком —
+    флуд-контроль Telegram действует на весь бот, а не на один чат.
+    """
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                    continue
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def pause(self, seconds):
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        self.tokens = 0
+
+bucket = TokenBucket(BROADCAST_RATE)
+# Запущенные рассылки: id -> задача
+_jobs = {}
+
+async def _deliver(bot: Bot, telegram_id, text):
+    for _ in range(MAX_RETRIES + 1):
+        await bucket.acquire()
+        try:
+            await bot.send_message(telegram_id, text)
+            return telegram_id, "sent", None
+        except TelegramRetryAfter as e:
+            logger.warning(f"Broadcast flood control, pausing for {e.retry_after} s")
+            bucket.pause(e.retry_after)
+        except TelegramForbiddenError as e:
+            return telegram_id, "blocked", e.message
+        except TelegramAPIError as e:
+            return telegram_id, "failed", e.message
+        except Exception as e:
+            return telegram_id, "failed", repr(e)
+    return telegram_id, "failed", "too many RetryAfter"
+
+def _progress_text(job):
+    done = job[7] + job[8] + job[9]
+    status = {"running": "⏳", "done": "✅", "cancelled": "⛔", "failed": "❌"}.get(job[4], job[4])
+    return (f"📣 Broadcast #{job[0]} {status}\n{done}/{job[6]} processed"
+            f"\nSent: {job[7]}, failed: {job[8]}, bot blocked: {job[9]}")
+
+async def _report(bot: Bot, broadcast_id):
+    job = await get_broadcast(broadcast_id)
+    try:
+        if job[3]:
+            await bot.edit_message_text(_progress_text(job), chat_id=job[2], message_id=job[3])
+        else:
+            message = await bot.send_message(job[2], _progress_text(job))
+            await set_broadcast_message(broadcast_id, message.message_id)
+    except TelegramAPIError as e:
+        # «message is not modified» и подобное не должно останавливать рассылку
+        logger.debug(f"Broadcast #{broadcast_id} progress update failed: {e}")
+
+async def run_broadcast(bot: Bot, broadcast_id):
+    """
+    Разослать сообщение задания: получатели выбираются пачками по
+    BROADCAST_BATCH_SIZE, статус каждого сохраняется, поэтому после
+    перезапуска рассылка продолжается с недоставленных.
+    """
+    text = (await get_broadcast(broadcast_id))[1]
+    sending = asyncio.Semaphore(BROADCAST_CONCURRENCY)
+
+    async def deliver(telegram_id):
+        async with sending:
+            result = await _deliver(bot, telegram_id, text)
+        # Статус пишется сразу: после сбоя повторно получат сообщение
+        # только те, чья отправка была в полёте
+        await record_deliveries(broadcast_id, [result])
+
+    async def report_progress():
+        while True:
+            await asyncio.sleep(BROADCAST_PROGRESS_INTERVAL)
+            await _report(bot, broadcast_id)
+
+    logger.info(f"Broadcast #{broadcast_id} started")
+    reporter = asyncio.create_task(report_progress())
+    try:
+        while recipients := await claim_broadcast_batch(broadcast_id, BROADCAST_BATCH_SIZE):
+            tasks = [asyncio.create_task(deliver(telegram_id)) for telegram_id in recipients]
+            try:
+                await asyncio.gather(*tasks)
+            finally:
+                # gather не отменяет остальные отправки, если одна из них упала
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+        await finish_broadcast(broadcast_id, "done")
+        logger.info(f"Broadcast #{broadcast_id} finished")
+    except asyncio.CancelledError:
+        # Остановка бота: задание остаётся running и продолжится при запуске
+        logger.info(f"Broadcast #{broadcast_id} interrupted")
+        raise
+    except Exception as e:
+        # Задание не остаётся висеть в running: админ видит сбой в чате
+        logger.error(f"Broadcast #{broadcast_id} failed: {e}")
+        await finish_broadcast(broadcast_id, "failed")
+    finally:
+        reporter.cancel()
+        _jobs.pop(broadcast_id, None)
+    await _report(bot, broadcast_id)
+
+def _start(bot: Bot, broadcast_id):
+    _jobs[broadcast_id] = asyncio.create_task(run_broadcast(bot, broadcast_id))
+
+async def prepare_broadcast(text, chat_id):
+    """Создать черновик рассылки. Возвращает (id, число получателей)."""
+    broadcast_id = await create_broadcast(text, chat_id)
+    return broadcast_id, (await get_broadcast(broadcast_id))[6]
+
+async def start_broadcast(bot: Bot, broadcast_id):
+    """Запустить подтверждённый черновик. False — черновика нет или он уже запущен/отменён."""
+    if not await confirm_broadcast(broadcast_id):
+        return False
+    await _report(bot, broadcast_id)
+    _start(bot, broadcast_id)
+    return True
+
+async def cancel_broadcast(bot: Bot, broadcast_id):
+    """Остановить рассылку. Возвращает False, если такой рассылки нет."""
+    if await get_broadcast(broadcast_id) is None:
+        return False
+    task = _jobs.get(broadcast_id)
+    if task is not None:
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+    await finish_broadcast(broadcast_id, "cancelled")
+    await _report(bot, broadcast_id)
+    return True
+
+async def resume_broadcasts(bot: Bot):
+    for job in await get_running_broadcasts():
+        if job[0] not in _jobs:
+            logger.info(f"Resuming broadcast #{job[0]}")
+            _start(bot, job[0])
+
+async def stop_broadcasts():
+    tasks = list(_jobs.values())
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
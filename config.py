@@ -6,4 +6,97 @@ load_dotenv()
 TELEGRAM_TOKEN = os.getenv("TELEGRAM_TOKEN")
 CRYPTOCLOUD_API_KEY = os.getenv("CRYPTOCLOUD_API_KEY")
 CRYPTOCLOUD_SHOP_ID = os.getenv("CRYPTOCLOUD_SHOP_ID")
+CRYPTOCLOUD_API_URL = os.getenv("CRYPTOCLOUD_API_URL", "https://api.cryptocloud.plus")
 ADMIN_ID = int(os.getenv("ADMIN_ID"))
+
+# Режим получения обновлений: polling или webhook. В режиме webhook за
+# балансировщиком несколько инстансов работают с одной БД, поэтому кэши
+# чтения по умолчанию выключены, а состояния FSM пишутся сразу
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+SHARED_DB = BOT_MODE == "webhook"
+
+# База данных
+DB_PATH = os.getenv("DB_PATH", "betsmilebot.db")
+DB_READERS = int(os.getenv("DB_READERS", "4"))
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "10000"))
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "0" if SHARED_DB else "300"))
+
+# Платёжный клиент
+PAYMENT_TIMEOUT = float(os.getenv("PAYMENT_TIMEOUT", "10"))
+PAYMENT_RETRIES = int(os.getenv("PAYMENT_RETRIES", "2"))
+PAYMENT_CONCURRENCY = int(os.getenv("PAYMENT_CONCURRENCY", "10"))
+
+# Сверка счетов CryptoCloud
+INVOICE_BATCH_SIZE = int(os.getenv("INVOICE_BATCH_SIZE", "100"))
+INVOICE_POLL_MIN = float(os.getenv("INVOICE_POLL_MIN", "15"))
+INVOICE_POLL_MAX = float(os.getenv("INVOICE_POLL_MAX", "600"))
+INVOICE_TTL = float(os.getenv("INVOICE_TTL", "86400"))
+
+# Отложенная запись журнала игр и транзакций
+WRITE_BEHIND = os.getenv("WRITE_BEHIND", "0") == "1"
+AUDIT_BATCH_SIZE = int(os.getenv("AUDIT_BATCH_SIZE", "200"))
+AUDIT_FLUSH_MS = float(os.getenv("AUDIT_FLUSH_MS", "500"))
+
+# Анимации: чат для предварительной загрузки GIF (пусто — не загружать)
+MEDIA_WARMUP_CHAT_ID = int(os.getenv("MEDIA_WARMUP_CHAT_ID", "0")) or None
+
+# Webhook
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+WEBHOOK_MAX_IN_FLIGHT = int(os.getenv("WEBHOOK_MAX_IN_FLIGHT", "100"))
+WEBHOOK_DRAIN_TIMEOUT = float(os.getenv("WEBHOOK_DRAIN_TIMEOUT", "30"))
+
+# Хранилище FSM
+FSM_CACHE_TTL = float(os.getenv("FSM_CACHE_TTL", "0" if SHARED_DB else "60"))
+FSM_STATE_TTL = float(os.getenv("FSM_STATE_TTL", "86400"))
+# 0 — писать каждое изменение сразу, до ответа обработчика
+FSM_FLUSH_MS = float(os.getenv("FSM_FLUSH_MS", "0" if SHARED_DB else "200"))
+
+# Очереди обновлений
+UPDATE_WORKERS = int(os.getenv("UPDATE_WORKERS", "64"))
+USER_QUEUE_LIMIT = int(os.getenv("USER_QUEUE_LIMIT", "10"))
+
+# Ограничение частоты действий: класс=ёмкость/пополнение в секунду.
+# Значения из RATE_LIMITS дополняют и переопределяют значения по умолчанию
+RATE_LIMITS = {"navigation": (10.0, 2.0), "bet": (3.0, 1.0), "deposit": (2.0, 0.1), "admin": (20.0, 5.0)}
+RATE_LIMITS.update(
+    (name.strip(), tuple(float(x) for x in value.split("/")))
+    for name, value in (item.split("=") for item in os.getenv("RATE_LIMITS", "").split(",") if item.strip())
+)
+RATE_BUCKET_IDLE = float(os.getenv("RATE_BUCKET_IDLE", "600"))
+
+# Автоигра: максимум раундов за один запрос
+AUTOPLAY_MAX_ROUNDS = int(os.getenv("AUTOPLAY_MAX_ROUNDS", "100"))
+
+# Метрики Prometheus на локальном порту (0 — выключить) и интервал профайлера
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9100"))
+PROFILER_INTERVAL_MS = float(os.getenv("PROFILER_INTERVAL_MS", "5"))
+
+# Журнал: JSON-файл с ротацией по размеру; доля сохраняемых записей
+# по уровням для шумных логгеров (аудит не отбрасывается никогда)
+LOG_FILE = os.getenv("LOG_FILE", "bot.log")
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_MAX_BYTES = int(os.getenv("LOG_MAX_BYTES", str(20 * 1024 * 1024)))
+LOG_BACKUPS = int(os.getenv("LOG_BACKUPS", "5"))
+LOG_SAMPLE_RATES = {
+    level.upper(): float(rate)
+    for level, rate in (item.split("=") for item in os.getenv("LOG_SAMPLE_RATES", "DEBUG=0.01,INFO=0.1").split(","))
+}
+LOG_SAMPLED_LOGGERS = os.getenv("LOG_SAMPLED_LOGGERS", "handlers").split(",")
+
+# Рассылки: сообщений в секунду на весь бот, размер пачки получателей,
+# одновременных отправок и период обновления прогресса в чате админа
+BROADCAST_RATE = float(os.getenv("BROADCAST_RATE", "25"))
+BROADCAST_BATCH_SIZE = int(os.getenv("BROADCAST_BATCH_SIZE", "500"))
+BROADCAST_CONCURRENCY = int(os.getenv("BROADCAST_CONCURRENCY", "25"))
+BROADCAST_PROGRESS_INTERVAL = float(os.getenv("BROADCAST_PROGRESS_INTERVAL", "5"))
+
+# Реферальная программа: доля каждого депозита приглашённого, которая
+# начисляется пригласившему; период и размер пачки начисления
+REFERRAL_BONUS_RATE = float(os.getenv("REFERRAL_BONUS_RATE", "0.05"))
+REFERRAL_INTERVAL = float(os.getenv("REFERRAL_INTERVAL", "60"))
+REFERRAL_BATCH_SIZE = int(os.getenv("REFERRAL_BATCH_SIZE", "500"))
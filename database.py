@@ -1,82 +1,704 @@
+import asyncio
 import sqlite3
 import random
+import threading
+import time
 import logging
+import metrics
+from logs import audit
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from config import (DB_PATH, DB_READERS, USER_CACHE_SIZE, USER_CACHE_TTL,
+                    WRITE_BEHIND, AUDIT_BATCH_SIZE, AUDIT_FLUSH_MS,
+                    REFERRAL_BONUS_RATE, REFERRAL_INTERVAL, REFERRAL_BATCH_SIZE)
 
 logger = logging.getLogger(__name__)
 
-def init_db():
+# Все обращения к БД идут через два пула потоков: один поток-писатель
+# (SQLite допускает только одного писателя) и несколько читателей.
+# Каждый поток держит своё долгоживущее соединение в режиме WAL,
+# поэтому чтения не ждут записей, а event loop не блокируется.
+_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-writer")
+_readers = ThreadPoolExecutor(max_workers=DB_READERS, thread_name_prefix="db-reader")
+_local = threading.local()
+_connections = []
+_connections_lock = threading.Lock()
+
+def _connect():
+    # cached_statements — кэш подготовленных выражений на соединение
+    conn = sqlite3.connect(DB_PATH, check_same_thread=False, cached_statements=256)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA busy_timeout=5000")
+    with _connections_lock:
+        _connections.append(conn)
+    return conn
+
+def _connection():
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = _local.conn = _connect()
+    return conn
+
+def _statement(func, args):
+    # Одиночные запросы подписываем текстом SQL, остальное — именем функции
+    if func in (_fetchone, _fetchall, _execute):
+        return " ".join(args[0].split())
+    return func.__name__.lstrip("_")
+
+def _read(func, args):
+    return func(_connection(), *args)
+
+def _write(func, args):
+    conn = _connection()
+    with conn:
+        return func(conn, *args)
+
+def _timed(pool, run, func, args, submitted):
+    # Время ожидания потока пула и время самого запроса считаем отдельно
+    started = time.perf_counter()
+    metrics.observe("bot_db_wait_seconds", started - submitted, pool=pool)
     try:
-        conn = sqlite3.connect("betsmilebot.db")
-        cursor = conn.cursor()
-        
-        # Таблица пользователей
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS users (
-                telegram_id INTEGER PRIMARY KEY,
-                language TEXT DEFAULT 'ru',
-                demo_balance REAL DEFAULT 10.0,
-                real_balance REAL DEFAULT 0.0,
-                is_blocked INTEGER DEFAULT 0,
-                referral_code TEXT,
-                referred_by INTEGER,
-                last_activity TIMESTAMP
-            )
-        """)
-        
-        # Таблица транзакций
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS transactions (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                telegram_id INTEGER,
-                amount REAL,
-                type TEXT,
-                status TEXT,
-                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
-            )
+        return run(func, args)
+    finally:
+        metrics.observe("bot_db_query_seconds", time.perf_counter() - started,
+                        pool=pool, statement=_statement(func, args))
+
+async def read(func, *args):
+    """Выполнить func(conn, *args) в пуле читателей."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_readers, _timed, "read", _read, func, args, time.perf_counter())
+
+async def transaction(func, *args):
+    """Выполнить func(conn, *args) в потоке-писателе в одной транзакции."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_writer, _timed, "write", _write, func, args, time.perf_counter())
+
+def _fetchone(conn, sql, params):
+    return conn.execute(sql, params).fetchone()
+
+def _fetchall(conn, sql, params):
+    return conn.execute(sql, params).fetchall()
+
+def _execute(conn, sql, params):
+    return conn.execute(sql, params).lastrowid
+
+async def fetchone(sql, params=()):
+    return await read(_fetchone, sql, params)
+
+async def fetchall(sql, params=()):
+    return await read(_fetchall, sql, params)
+
+async def execute(sql, params=()):
+    return await transaction(_execute, sql, params)
+
+def close_db():
+    _writer.shutdown(wait=True)
+    _readers.shutdown(wait=True)
+    with _connections_lock:
+        for conn in _connections:
+            conn.close()
+        _connections.clear()
+    logger.info("Database connections closed")
+
+def _init_db(conn):
+    # Таблица пользователей
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS users (
+            telegram_id INTEGER PRIMARY KEY,
+            language TEXT DEFAULT 'ru',
+            demo_balance REAL DEFAULT 10.0,
+            real_balance REAL DEFAULT 0.0,
+            is_blocked INTEGER DEFAULT 0,
+            referral_code TEXT,
+            referred_by INTEGER,
+            last_activity TIMESTAMP
+        )
+    """)
+
+    # Таблица транзакций
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS transactions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            telegram_id INTEGER,
+            amount REAL,
+            type TEXT,
+            status TEXT,
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+    # Таблица игр
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS games (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            telegram_id INTEGER,
+            game_type TEXT,
+            amount REAL,
+            result TEXT,
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_games_user_time ON games (telegram_id, timestamp)")
+
+    # Счётчик сыгранных игр, чтобы не считать историю на каждой ставке
+    if _add_column(conn, "users", "games_played", "INTEGER DEFAULT 0"):
+        conn.execute("""
+            UPDATE users SET games_played =
+                (SELECT COUNT(*) FROM games WHERE games.telegram_id = users.telegram_id)
         """)
-        
-        # Таблица игр
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS games (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                telegram_id INTEGER,
-                game_type TEXT,
-                amount REAL,
-                result TEXT,
-                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
-            )
+
+    # Счётчики реферальной программы у пригласившего
+    if _add_column(conn, "users", "referrals", "INTEGER DEFAULT 0"):
+        conn.execute("""
+            UPDATE users SET referrals =
+                (SELECT COUNT(*) FROM users AS invited WHERE invited.referred_by = users.telegram_id)
         """)
-        
-        conn.commit()
+    _add_column(conn, "users", "referral_bonus", "REAL DEFAULT 0")
+    # Уникальный индекс по коду: перед его созданием выдаём новые коды
+    # пользователям без кода и всем, кроме первого владельца, у старых
+    # повторяющихся кодов
+    if not conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'idx_users_referral_code'").fetchone():
+        duplicates = conn.execute("""
+            SELECT telegram_id FROM users WHERE referral_code IS NULL OR telegram_id NOT IN
+                (SELECT MIN(telegram_id) FROM users WHERE referral_code IS NOT NULL GROUP BY referral_code)
+        """).fetchall()
+        for (telegram_id,) in duplicates:
+            _assign_referral_code(conn, "UPDATE users SET referral_code = ? WHERE telegram_id = ?", (telegram_id,))
+        conn.execute("CREATE UNIQUE INDEX idx_users_referral_code ON users (referral_code)")
+
+    # Таблица счетов CryptoCloud, ожидающих оплаты
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS invoices (
+            order_id TEXT PRIMARY KEY,
+            uuid TEXT,
+            telegram_id INTEGER,
+            amount REAL,
+            currency TEXT,
+            status TEXT DEFAULT 'open',
+            checks INTEGER DEFAULT 0,
+            created_at REAL,
+            next_check_at REAL
+        )
+    """)
+    # Частичный индекс: в нём только открытые счета, поэтому выборка
+    # следующей пачки не зависит от числа уже закрытых
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_invoices_open ON invoices (next_check_at) WHERE status = 'open'")
+
+    # file_id анимаций, уже загруженных в Telegram
+    conn.execute("CREATE TABLE IF NOT EXISTS media_cache (key TEXT PRIMARY KEY, url TEXT, file_id TEXT)")
+
+    # Состояния FSM (см. storage.SQLiteStorage)
+    conn.execute("CREATE TABLE IF NOT EXISTS fsm (key TEXT PRIMARY KEY, state TEXT, data TEXT, updated_at REAL)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_fsm_updated_at ON fsm (updated_at)")
+
+    # Рассылки: задание и статус доставки каждому получателю, чтобы
+    # прерванную рассылку можно было продолжить с того же места
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS broadcasts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            text TEXT,
+            chat_id INTEGER,
+            message_id INTEGER,
+            status TEXT DEFAULT 'running',
+            cursor INTEGER DEFAULT 0,
+            total INTEGER DEFAULT 0,
+            sent INTEGER DEFAULT 0,
+            failed INTEGER DEFAULT 0,
+            blocked INTEGER DEFAULT 0,
+            created_at REAL,
+            finished_at REAL
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS broadcast_deliveries (
+            broadcast_id INTEGER,
+            telegram_id INTEGER,
+            status TEXT DEFAULT 'pending',
+            error TEXT,
+            PRIMARY KEY (broadcast_id, telegram_id)
+        ) WITHOUT ROWID
+    """)
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_broadcast_deliveries_pending
+        ON broadcast_deliveries (broadcast_id, telegram_id) WHERE status = 'pending'
+    """)
+
+    # Агрегаты для админ-панели, обновляются вместе с исходными строками
+    conn.execute("CREATE TABLE IF NOT EXISTS stats (key TEXT PRIMARY KEY, value REAL DEFAULT 0)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_transactions_type_status ON transactions (type, status)")
+    if conn.execute("SELECT COUNT(*) FROM stats").fetchone()[0] == 0:
+        _recompute_stats(conn)
+
+    # Состояние фоновых задач (курсоры), отдельно от показываемых агрегатов;
+    # курсор реферальных бонусов раньше лежал в stats — переносим
+    conn.execute("CREATE TABLE IF NOT EXISTS job_state (key TEXT PRIMARY KEY, value INTEGER)")
+    conn.execute("""
+        INSERT OR IGNORE INTO job_state (key, value)
+        SELECT key, CAST(value AS INTEGER) FROM stats WHERE key = 'referral_cursor'
+    """)
+    conn.execute("DELETE FROM stats WHERE key = 'referral_cursor'")
+
+def _add_column(conn, table, column, decl):
+    columns = [row[1] for row in conn.execute(f"PRAGMA table_info({table})")]
+    if column in columns:
+        return False
+    conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+    return True
+
+async def init_db():
+    try:
+        await transaction(_init_db)
         logger.info("Database initialized successfully")
     except Exception as e:
         logger.error(f"Error initializing database: {e}")
-    finally:
-        conn.close()
-
-def get_user(telegram_id):
-    conn = sqlite3.connect("betsmilebot.db")
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM users WHERE telegram_id = ?", (telegram_id,))
-    user = cursor.fetchone()
-    conn.close()
+
+# Кэш профилей пользователей: LRU с ограничением по размеру и TTL.
+# Ставки (settle_bet/settle_rounds) и update_language обновляют кэш сразу
+# (write-through), add_user просто сбрасывает запись. Кэш видит только
+# записи своего процесса, поэтому при общей БД (режим webhook) USER_CACHE_TTL
+# по умолчанию 0 и профиль всегда читается из БД.
+_user_cache = OrderedDict()
+_cache_stats = {"hits": 0, "misses": 0}
+# Счётчик записей: если во время чтения из БД произошла запись,
+# прочитанная строка может быть устаревшей и в кэш не кладётся
+_cache_writes = 0
+
+def _cache_put(telegram_id, user):
+    global _cache_writes
+    _cache_writes += 1
+    if user is None:
+        _user_cache.pop(telegram_id, None)
+        return
+    _user_cache[telegram_id] = (time.monotonic() + USER_CACHE_TTL, user)
+    _user_cache.move_to_end(telegram_id)
+    while len(_user_cache) > USER_CACHE_SIZE:
+        _user_cache.popitem(last=False)
+
+def invalidate_user(telegram_id):
+    _cache_put(telegram_id, None)
+
+def cached_user(telegram_id):
+    """Пользователь из кэша без обращения к БД (None, если его там нет)."""
+    entry = _user_cache.get(telegram_id)
+    return entry[1] if entry is not None else None
+
+def cache_stats():
+    return dict(_cache_stats, size=len(_user_cache))
+
+async def get_user(telegram_id):
+    entry = _user_cache.get(telegram_id)
+    if entry is not None and entry[0] > time.monotonic():
+        _user_cache.move_to_end(telegram_id)
+        _cache_stats["hits"] += 1
+        return entry[1]
+    _cache_stats["misses"] += 1
+    writes = _cache_writes
+    user = await read(_select_user, telegram_id)
+    if writes == _cache_writes:
+        _cache_put(telegram_id, user)
+    return user
+
+def _select_user(conn, telegram_id):
+    return conn.execute("SELECT * FROM users WHERE telegram_id = ?", (telegram_id,)).fetchone()
+
+# Без похожих символов (0/O, 1/I), чтобы код можно было продиктовать
+REFERRAL_ALPHABET = "23456789ABCDEFGHJKLMNPQRSTUVWXYZ"
+REFERRAL_CODE_LENGTH = 8
+
+def _assign_referral_code(conn, sql, params):
+    # Случайный код; при совпадении с существующим уникальный индекс
+    # отклонит запись, и пробуем следующий
+    while True:
+        code = "".join(random.choices(REFERRAL_ALPHABET, k=REFERRAL_CODE_LENGTH))
+        try:
+            conn.execute(sql, (code, *params))
+            return code
+        except sqlite3.IntegrityError:
+            if conn.execute("SELECT 1 FROM users WHERE referral_code = ?", (code,)).fetchone() is None:
+                raise
+
+def _add_user(conn, telegram_id, referrer_code):
+    if conn.execute("SELECT 1 FROM users WHERE telegram_id = ?", (telegram_id,)).fetchone():
+        return None
+    referrer = None
+    if referrer_code:
+        row = conn.execute("SELECT telegram_id FROM users WHERE referral_code = ?", (referrer_code,)).fetchone()
+        referrer = row[0] if row else None
+    _assign_referral_code(conn, "INSERT INTO users (referral_code, telegram_id, referred_by) VALUES (?, ?, ?)",
+                          (telegram_id, referrer))
+    if referrer is not None:
+        conn.execute("UPDATE users SET referrals = referrals + 1 WHERE telegram_id = ?", (referrer,))
+    _bump_stat(conn, "user_count", 1)
+    return referrer
+
+async def add_user(telegram_id, referrer_code=None):
+    """
+    Зарегистрировать пользователя, если его ещё нет. referrer_code — код из
+    ссылки /start <код>: пригласивший запоминается в referred_by.
+    Возвращает telegram_id пригласившего или None.
+    """
+    referrer = await transaction(_add_user, telegram_id, referrer_code.strip().upper() if referrer_code else None)
+    invalidate_user(telegram_id)
+    if referrer is not None:
+        invalidate_user(referrer)
+    return referrer
+
+def _update_language(conn, telegram_id, lang):
+    conn.execute("UPDATE users SET language = ? WHERE telegram_id = ?", (lang, telegram_id))
+    return _select_user(conn, telegram_id)
+
+async def update_language(telegram_id, lang):
+    _cache_put(telegram_id, await transaction(_update_language, telegram_id, lang))
+
+_INSERT_GAME = "INSERT INTO games (telegram_id, game_type, amount, result) VALUES (?, ?, ?, ?)"
+_INSERT_TRANSACTION = "INSERT INTO transactions (telegram_id, amount, type, status) VALUES (?, ?, ?, ?)"
+
+def _audit_rows(telegram_id, mode, game_type, amount, results, win_amount):
+    rows = [(_INSERT_GAME, (telegram_id, game_type, amount, result)) for result in results]
+    if mode == "real" and win_amount > 0:
+        rows.append((_INSERT_TRANSACTION, (telegram_id, win_amount, "win", "completed")))
+    return rows
+
+def _settle_bet(conn, telegram_id, mode, game_type, amount, results, win_amount):
+    column = "real_balance" if mode == "real" else "demo_balance"
+    stake = amount * len(results)
+    # Условный UPDATE: ставка проходит, только если на балансе всё ещё хватает средств
+    cursor = conn.execute(f"""
+        UPDATE users SET {column} = {column} + ? - ?,
+                         games_played = games_played + ?,
+                         last_activity = CURRENT_TIMESTAMP
+        WHERE telegram_id = ? AND {column} >= ?
+    """, (win_amount, stake, len(results), telegram_id, stake))
+    if cursor.rowcount == 0:
+        return None
+    if not WRITE_BEHIND:
+        _flush_audit(conn, _audit_rows(telegram_id, mode, game_type, amount, results, win_amount))
+    return _select_user(conn, telegram_id)
+
+async def settle_bet(telegram_id, mode, game_type, amount, result, win_amount):
+    """
+    Провести ставку одной транзакцией: списать/начислить баланс, записать игру
+    и выигрыш в реальном режиме. Возвращает обновлённого пользователя или None,
+    если средств недостаточно. При WRITE_BEHIND синхронно меняется только баланс,
+    а записи в games/transactions уходят в очередь.
+    """
+    return await settle_rounds(telegram_id, mode, game_type, amount, [result], win_amount)
+
+async def settle_rounds(telegram_id, mode, game_type, amount, results, win_amount):
+    """
+    То же для серии раундов с одинаковой ставкой: списывается amount * len(results),
+    начисляется суммарный выигрыш win_amount одной записью в transactions.
+    """
+    user = await transaction(_settle_bet, telegram_id, mode, game_type, amount, results, win_amount)
+    if user is not None:
+        _cache_put(telegram_id, user)
+        if WRITE_BEHIND:
+            for sql, params in _audit_rows(telegram_id, mode, game_type, amount, results, win_amount):
+                queue_audit(sql, params)
     return user
 
-def update_balance(telegram_id, demo_balance=None, real_balance=None):
-    conn = sqlite3.connect("betsmilebot.db")
-    cursor = conn.cursor()
-    if demo_balance is not None:
-        cursor.execute("UPDATE users SET demo_balance = ? WHERE telegram_id = ?", (demo_balance, telegram_id))
-    if real_balance is not None:
-        cursor.execute("UPDATE users SET real_balance = ? WHERE telegram_id = ?", (real_balance, telegram_id))
-    cursor.execute("UPDATE users SET last_activity = CURRENT_TIMESTAMP WHERE telegram_id = ?", (telegram_id,))
-    conn.commit()
-    conn.close()
-
-def add_user(telegram_id, referral_code=None):
-    conn = sqlite3.connect("betsmilebot.db")
-    cursor = conn.cursor()
-    code = str(random.randint(100000, 999999)) if not referral_code else referral_code
-    cursor.execute("INSERT OR IGNORE INTO users (telegram_id, referral_code) VALUES (?, ?)", (telegram_id, code))
-    conn.commit()
-    conn.close()
+# Отложенная запись журнальных строк (games, transactions): копятся в памяти
+# и сбрасываются через executemany каждые AUDIT_BATCH_SIZE строк или AUDIT_FLUSH_MS
+_audit_queue = []
+_audit_full = asyncio.Event()
+_audit_stats = {"queued": 0, "flushed": 0, "flushes": 0, "last_flush_ms": 0.0, "max_flush_ms": 0.0}
+
+def queue_audit(sql, params):
+    _audit_queue.append((sql, params))
+    _audit_stats["queued"] += 1
+    if len(_audit_queue) >= AUDIT_BATCH_SIZE:
+        _audit_full.set()
+
+def audit_stats():
+    return dict(_audit_stats, depth=len(_audit_queue))
+
+def _flush_audit(conn, rows):
+    grouped = {}
+    for sql, params in rows:
+        grouped.setdefault(sql, []).append(params)
+    for sql, params in grouped.items():
+        conn.executemany(sql, params)
+
+async def flush_audit():
+    global _audit_queue
+    if not _audit_queue:
+        return
+    rows, _audit_queue = _audit_queue, []
+    started = time.perf_counter()
+    # Отмена (остановка бота) не прерывает уже начатую запись: дожидаемся её,
+    # иначе строки пропадут или, если поток-писатель их всё же запишет, задвоятся
+    write = asyncio.ensure_future(transaction(_flush_audit, rows))
+    try:
+        await asyncio.shield(write)
+    except asyncio.CancelledError:
+        try:
+            await write
+        except Exception:
+            _audit_queue = rows + _audit_queue
+        raise
+    except Exception as e:
+        # Возвращаем строки в начало очереди, следующая попытка их подхватит
+        _audit_queue = rows + _audit_queue
+        logger.error(f"Audit flush of {len(rows)} rows failed: {e}")
+        return
+    elapsed = (time.perf_counter() - started) * 1000
+    _audit_stats["flushed"] += len(rows)
+    _audit_stats["flushes"] += 1
+    _audit_stats["last_flush_ms"] = elapsed
+    _audit_stats["max_flush_ms"] = max(_audit_stats["max_flush_ms"], elapsed)
+
+async def run_audit_writer():
+    logger.info("Audit write-behind started")
+    while True:
+        try:
+            await asyncio.wait_for(_audit_full.wait(), AUDIT_FLUSH_MS / 1000)
+        except asyncio.TimeoutError:
+            pass
+        _audit_full.clear()
+        await flush_audit()
+
+async def add_invoice(order_id, uuid, telegram_id, amount, currency, next_check_at):
+    await execute("""
+        INSERT INTO invoices (order_id, uuid, telegram_id, amount, currency, created_at, next_check_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    """, (order_id, uuid, telegram_id, amount, currency, time.time(), next_check_at))
+
+async def get_due_invoices(now, limit):
+    return await fetchall("""
+        SELECT order_id, uuid, telegram_id, amount, checks, created_at FROM invoices
+        WHERE status = 'open' AND next_check_at <= ?
+        ORDER BY next_check_at LIMIT ?
+    """, (now, limit))
+
+async def next_invoice_check():
+    return (await fetchone("SELECT MIN(next_check_at) FROM invoices WHERE status = 'open'"))[0]
+
+def _settle_invoices(conn, paid, closed, rescheduled):
+    credited = []
+    for order_id, telegram_id, amount in paid:
+        # Переход open -> paid выполняется ровно один раз, поэтому
+        # повторная обработка того же счёта ничего не начислит
+        cursor = conn.execute("UPDATE invoices SET status = 'paid' WHERE order_id = ? AND status = 'open'", (order_id,))
+        if cursor.rowcount == 0:
+            continue
+        conn.execute("UPDATE users SET real_balance = real_balance + ? WHERE telegram_id = ?", (amount, telegram_id))
+        conn.execute(_INSERT_TRANSACTION, (telegram_id, amount, "deposit", "completed"))
+        _bump_stat(conn, "total_deposits", amount)
+        credited.append(telegram_id)
+    conn.executemany("UPDATE invoices SET status = ? WHERE order_id = ? AND status = 'open'", closed)
+    conn.executemany("UPDATE invoices SET checks = checks + 1, next_check_at = ? WHERE order_id = ? AND status = 'open'",
+                     rescheduled)
+    return credited
+
+async def settle_invoices(paid, closed=(), rescheduled=()):
+    """
+    Обработать результаты проверки пачки счетов одной транзакцией.
+    paid — (order_id, telegram_id, amount), closed — (status, order_id),
+    rescheduled — (next_check_at, order_id). Возвращает id зачисленных пользователей.
+    """
+    credited = await transaction(_settle_invoices, list(paid), list(closed), list(rescheduled))
+    for telegram_id in credited:
+        invalidate_user(telegram_id)
+    return credited
+
+# Реферальные бонусы начисляются пачками: курсор (id последнего
+# обработанного депозита) хранится в job_state, каждый депозит учитывается один раз
+def _credit_referral_bonuses(conn, limit):
+    row = conn.execute("SELECT value FROM job_state WHERE key = 'referral_cursor'").fetchone()
+    after = row[0] if row else 0
+    deposits = conn.execute("""
+        SELECT transactions.id, users.referred_by, transactions.amount FROM transactions
+        JOIN users ON users.telegram_id = transactions.telegram_id
+        WHERE transactions.type = 'deposit' AND transactions.status = 'completed' AND transactions.id > ?
+        ORDER BY transactions.id LIMIT ?
+    """, (after, limit)).fetchall()
+    if not deposits:
+        return 0, {}
+    bonuses = {}
+    for _, referrer, amount in deposits:
+        if referrer is not None:
+            bonuses[referrer] = bonuses.get(referrer, 0) + amount * REFERRAL_BONUS_RATE
+    conn.executemany("""
+        UPDATE users SET real_balance = real_balance + ?, referral_bonus = referral_bonus + ?
+        WHERE telegram_id = ?
+    """, [(bonus, bonus, referrer) for referrer, bonus in bonuses.items()])
+    conn.executemany(_INSERT_TRANSACTION, [(referrer, bonus, "referral_bonus", "completed")
+                                           for referrer, bonus in bonuses.items()])
+    conn.execute("INSERT OR REPLACE INTO job_state (key, value) VALUES ('referral_cursor', ?)", (deposits[-1][0],))
+    return len(deposits), bonuses
+
+async def credit_referral_bonuses():
+    """Начислить бонусы по одной пачке новых депозитов. Возвращает (депозитов, {пригласивший: бонус})."""
+    processed, bonuses = await transaction(_credit_referral_bonuses, REFERRAL_BATCH_SIZE)
+    for referrer in bonuses:
+        invalidate_user(referrer)
+    return processed, bonuses
+
+async def run_referral_bonuses():
+    logger.info("Referral bonus crediting started")
+    while True:
+        try:
+            processed, bonuses = await credit_referral_bonuses()
+            for referrer, bonus in bonuses.items():
+                logger.info(f"Referral bonus {bonus} credited to user {referrer}",
+                            extra=audit(event="referral_bonus", user_id=referrer, amount=bonus))
+            if processed >= REFERRAL_BATCH_SIZE:
+                # Пачка заполнена — депозиты ещё есть, продолжаем сразу
+                await asyncio.sleep(0)
+                continue
+        except Exception as e:
+            logger.error(f"Referral bonus crediting failed: {e}")
+        await asyncio.sleep(REFERRAL_INTERVAL)
+
+def _add_withdrawal(conn, telegram_id, amount):
+    conn.execute(_INSERT_TRANSACTION, (telegram_id, amount, "withdraw", "pending"))
+    _bump_stat(conn, "pending_withdrawals", amount)
+
+async def add_withdrawal(telegram_id, amount):
+    await transaction(_add_withdrawal, telegram_id, amount)
+
+def _bump_stat(conn, key, delta):
+    conn.execute("INSERT INTO stats (key, value) VALUES (?, ?) ON CONFLICT (key) DO UPDATE SET value = value + excluded.value",
+                 (key, delta))
+
+def _recompute_stats(conn):
+    conn.execute("""
+        INSERT OR REPLACE INTO stats (key, value)
+        SELECT 'user_count', COUNT(*) FROM users
+        UNION ALL
+        SELECT 'total_deposits', COALESCE(SUM(amount), 0) FROM transactions WHERE type = 'deposit' AND status = 'completed'
+        UNION ALL
+        SELECT 'pending_withdrawals', COALESCE(SUM(amount), 0) FROM transactions WHERE type = 'withdraw' AND status = 'pending'
+    """)
+
+async def get_stats():
+    return dict(await fetchall("SELECT key, value FROM stats"))
+
+async def recompute_stats():
+    """Пересчитать агрегаты с нуля по исходным таблицам (для сверки)."""
+    await transaction(_recompute_stats)
+    return await get_stats()
+
+def _create_broadcast(conn, text, chat_id):
+    total = conn.execute("SELECT COUNT(*) FROM users WHERE is_blocked = 0").fetchone()[0]
+    return conn.execute("INSERT INTO broadcasts (text, chat_id, status, total, created_at) VALUES (?, ?, 'draft', ?, ?)",
+                        (text, chat_id, total, time.time())).lastrowid
+
+async def create_broadcast(text, chat_id):
+    """Черновик рассылки: ничего не отправляется до confirm_broadcast."""
+    return await transaction(_create_broadcast, text, chat_id)
+
+def _confirm_broadcast(conn, broadcast_id):
+    return conn.execute("""
+        UPDATE broadcasts SET status = 'running', total = (SELECT COUNT(*) FROM users WHERE is_blocked = 0)
+        WHERE id = ? AND status = 'draft'
+    """, (broadcast_id,)).rowcount == 1
+
+async def confirm_broadcast(broadcast_id):
+    """Перевести черновик в running. False — черновика нет или он уже обработан."""
+    return await transaction(_confirm_broadcast, broadcast_id)
+
+async def set_broadcast_message(broadcast_id, message_id):
+    await execute("UPDATE broadcasts SET message_id = ? WHERE id = ?", (message_id, broadcast_id))
+
+BROADCAST_COLUMNS = ("id", "text", "chat_id", "message_id", "status", "cursor", "total",
+                     "sent", "failed", "blocked", "created_at", "finished_at")
+
+async def get_broadcast(broadcast_id):
+    return await fetchone(f"SELECT {', '.join(BROADCAST_COLUMNS)} FROM broadcasts WHERE id = ?", (broadcast_id,))
+
+async def get_running_broadcasts():
+    return await fetchall(f"SELECT {', '.join(BROADCAST_COLUMNS)} FROM broadcasts WHERE status = 'running' ORDER BY id")
+
+def _claim_broadcast_batch(conn, broadcast_id, limit):
+    # Сначала недоставленные остатки прерванной пачки, затем следующая
+    # страница незаблокированных пользователей после курсора
+    pending = conn.execute("""
+        SELECT telegram_id FROM broadcast_deliveries
+        WHERE broadcast_id = ? AND status = 'pending' ORDER BY telegram_id LIMIT ?
+    """, (broadcast_id, limit)).fetchall()
+    if pending:
+        return [row[0] for row in pending]
+    cursor = conn.execute("SELECT cursor FROM broadcasts WHERE id = ?", (broadcast_id,)).fetchone()[0]
+    recipients = [row[0] for row in conn.execute("""
+        SELECT telegram_id FROM users WHERE telegram_id > ? AND is_blocked = 0 ORDER BY telegram_id LIMIT ?
+    """, (cursor, limit))]
+    if recipients:
+        conn.executemany("INSERT OR IGNORE INTO broadcast_deliveries (broadcast_id, telegram_id) VALUES (?, ?)",
+                         [(broadcast_id, telegram_id) for telegram_id in recipients])
+        conn.execute("UPDATE broadcasts SET cursor = ? WHERE id = ?", (recipients[-1], broadcast_id))
+    return recipients
+
+async def claim_broadcast_batch(broadcast_id, limit):
+    """Следующие получатели рассылки; пустой список — получателей больше нет."""
+    return await transaction(_claim_broadcast_batch, broadcast_id, limit)
+
+def _record_deliveries(conn, broadcast_id, results):
+    conn.executemany("""
+        UPDATE broadcast_deliveries SET status = ?, error = ?
+        WHERE broadcast_id = ? AND telegram_id = ? AND status = 'pending'
+    """, [(status, error, broadcast_id, telegram_id) for telegram_id, status, error in results])
+    counts = {status: sum(result[1] == status for result in results) for status in ("sent", "failed", "blocked")}
+    conn.execute("UPDATE broadcasts SET sent = sent + ?, failed = failed + ?, blocked = blocked + ? WHERE id = ?",
+                 (counts["sent"], counts["failed"], counts["blocked"], broadcast_id))
+
+async def record_deliveries(broadcast_id, results):
+    """results: [(telegram_id, 'sent' | 'failed' | 'blocked', ошибка или None)]."""
+    await transaction(_record_deliveries, broadcast_id, results)
+
+async def finish_broadcast(broadcast_id, status):
+    await execute("UPDATE broadcasts SET status = ?, finished_at = ? WHERE id = ? AND status IN ('draft', 'running')",
+                  (status, time.time(), broadcast_id))
+
+async def get_media_file_ids():
+    return {key: (url, file_id) for key, url, file_id in await fetchall("SELECT key, url, file_id FROM media_cache")}
+
+async def save_media_file_id(key, url, file_id):
+    await execute("INSERT OR REPLACE INTO media_cache (key, url, file_id) VALUES (?, ?, ?)", (key, url, file_id))
+
+# Постраничная выборка по ключу (keyset): следующая страница начинается
+# после последнего показанного id, поэтому стоимость не растёт с номером страницы
+USER_COLUMNS = ("telegram_id", "language", "demo_balance", "real_balance", "is_blocked",
+                "referral_code", "referred_by", "last_activity", "games_played", "referrals", "referral_bonus")
+TRANSACTION_COLUMNS = ("id", "telegram_id", "amount", "type", "status", "timestamp")
+
+async def page_users(after_id=0, limit=10, min_balance=None, blocked=False, since=None, until=None):
+    where, params = ["telegram_id > ?"], [after_id]
+    if min_balance is not None:
+        where.append("real_balance >= ?")
+        params.append(min_balance)
+    if blocked:
+        where.append("is_blocked = 1")
+    if since:
+        where.append("last_activity >= ?")
+        params.append(since)
+    if until:
+        where.append("last_activity < ?")
+        params.append(until)
+    return await fetchall(f"""
+        SELECT {', '.join(USER_COLUMNS)} FROM users
+        WHERE {' AND '.join(where)} ORDER BY telegram_id LIMIT ?
+    """, (*params, limit))
+
+async def page_transactions(after_id=0, limit=10, type=None, status=None, min_amount=None, since=None, until=None):
+    where, params = ["id > ?"], [after_id]
+    if type:
+        where.append("type = ?")
+        params.append(type)
+    if status:
+        where.append("status = ?")
+        params.append(status)
+    if min_amount is not None:
+        where.append("amount >= ?")
+        params.append(min_amount)
+    if since:
+        where.append("timestamp >= ?")
+        params.append(since)
+    if until:
+        where.append("timestamp < ?")
+        params.append(until)
+    return await fetchall(f"""
+        SELECT {', '.join(TRANSACTION_COLUMNS)} FROM transactions
+        WHERE {' AND '.join(where)} ORDER BY id LIMIT ?
+    """, (*params, limit))
@@ -1,55 +1,52 @@
-import random
-import sqlite3
-from database import get_user
+from database import get_user, settle_bet, settle_rounds
+from odds import GAMES, NEW_USER_GAMES, resolve_round
+from logs import audit
 import logging
 
 logger = logging.getLogger(__name__)
 
-def play_game(telegram_id, mode, amount, game_type):
-    user = get_user(telegram_id)
-    is_new_user = len(get_games(telegram_id)) < 3
-    win_chance = 0.6 if is_new_user and mode == "real" else 0.75 if mode == "demo" else 0.25
-    
-    result = "lose"
-    win_amount = 0
-    
-    if game_type == "guess_number":
-        correct = random.randint(1, 5)
-        user_guess = random.randint(1, 5)  # Симуляция выбора
-        if random.random() < win_chance and user_guess == correct:
-            result = "win_guess_number"
-            win_amount = amount * 2
-    elif game_type == "coin_flip":
-        if random.random() < win_chance:
-            result = "win_coin_flip"
-            win_amount = amount * 2
-    elif game_type == "find_card":
-        if random.random() < win_chance:
-            result = "win_find_card"
-            win_amount = amount * 3
-    elif game_type == "dice":
-        if random.random() < win_chance:
-            result = "win_dice"
-            win_amount = amount * 2
-    elif game_type == "wheel":
-        if random.random() < win_chance:
-            result = "win_wheel"
-            win_amount = amount * 4
-    
-    conn = sqlite3.connect("betsmilebot.db")
-    cursor = conn.cursor()
-    cursor.execute("INSERT INTO games (telegram_id, game_type, amount, result) VALUES (?, ?, ?, ?)",
-                  (telegram_id, game_type, amount, result))
-    conn.commit()
-    conn.close()
-    
-    logger.info(f"Game played: {game_type}, Result: {result}, User: {telegram_id}")
+async def play_game(telegram_id, mode, amount, game_type):
+    user = await get_user(telegram_id)
+    game = GAMES.get(game_type)
+    result, multiplier = resolve_round(game, mode, user[8] < NEW_USER_GAMES) if game else ("lose", 0)
+    win_amount = amount * multiplier
+
+    if await settle_bet(telegram_id, mode, game_type, amount, result, win_amount) is None:
+        logger.warning(f"Bet rejected, insufficient {mode} balance: {amount}, User: {telegram_id}",
+                       extra=audit(event="bet_rejected", user_id=telegram_id, game_type=game_type, amount=amount))
+        return None, 0
+
+    logger.info(f"Game played: {game_type}, Result: {result}, User: {telegram_id}",
+                extra=audit(event="game", user_id=telegram_id, game_type=game_type, amount=amount, result=result))
     return result, win_amount
 
-def get_games(telegram_id):
-    conn = sqlite3.connect("betsmilebot.db")
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM games WHERE telegram_id = ?", (telegram_id,))
-    games = cursor.fetchall()
-    conn.close()
-    return games
+async def autoplay(telegram_id, game_type, amount, rounds):
+    """
+    Сыграть rounds раундов с одинаковой ставкой за один проход и провести
+    итог одной транзакцией. Режим выбирается как в обычной игре, но баланса
+    должно хватать на все раунды сразу. Возвращает (побед, суммарный выигрыш)
+    или None, если средств недостаточно или игры нет.
+    """
+    user = await get_user(telegram_id)
+    game = GAMES.get(game_type)
+    stake = amount * rounds
+    if game is None or (user[2] < stake and user[3] < stake):
+        return None
+    mode = "real" if user[3] >= stake else "demo"
+
+    results, win_amount = [], 0
+    for i in range(rounds):
+        result, multiplier = resolve_round(game, mode, user[8] + i < NEW_USER_GAMES)
+        results.append(result)
+        win_amount += amount * multiplier
+
+    if await settle_rounds(telegram_id, mode, game_type, amount, results, win_amount) is None:
+        logger.warning(f"Autoplay rejected, insufficient {mode} balance: {stake}, User: {telegram_id}",
+                       extra=audit(event="bet_rejected", user_id=telegram_id, game_type=game_type, amount=stake))
+        return None
+
+    wins = sum(result != "lose" for result in results)
+    logger.info(f"Autoplay: {game_type} x{rounds}, Wins: {wins}, Won: {win_amount}, User: {telegram_id}",
+                extra=audit(event="autoplay", user_id=telegram_id, game_type=game_type, amount=stake,
+                            result=f"{wins}/{rounds}"))
+    return wins, win_amount
@@ -1,14 +1,17 @@
-from aiogram import Dispatcher, types
-from aiogram.filters import CommandStart, Command
+from aiogram import Bot, Dispatcher, types
+from aiogram.filters import CommandStart, Command, CommandObject
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
-from database import get_user, update_balance, add_user
-from games import play_game
+from database import get_user, add_user, update_language, add_withdrawal
+from games import play_game, autoplay
+from odds import GAMES
 from payments import create_payment
-from utils import get_text, ANIMATION_GIFS
+from keyboards import catalog, LANGUAGE_MENU
+from media import get_animation, remember_animation
+from logs import audit
+from config import AUTOPLAY_MAX_ROUNDS
 import random
-import asyncio
 import logging
 
 logger = logging.getLogger(__name__)
@@ -20,172 +23,155 @@ class GameStates(StatesGroup):
 
 def register_handlers(dp: Dispatcher):
     @dp.message(CommandStart())
-    async def start_command(message: types.Message, state: FSMContext):
+    async def start_command(message: types.Message, state: FSMContext, command: CommandObject):
         logger.info(f"Received /start command from user {message.from_user.id}")
         telegram_id = message.from_user.id
-        args = message.get_args()
-        referral_code = args if args else None
-        add_user(telegram_id, referral_code)
+        # Ссылка t.me/<бот>?start=<код> приходит как /start <код>
+        referrer = await add_user(telegram_id, command.args)
+        if referrer is not None:
+            logger.info(f"User {telegram_id} referred by {referrer}",
+                        extra=audit(event="referral", user_id=telegram_id, result=referrer))
         
-        keyboard = InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(text="🇷🇺 Русский", callback_data="lang_ru"),
-             InlineKeyboardButton(text="🇬🇧 English", callback_data="lang_en")]
-        ])
-        await message.answer(get_text("select_language", "ru"), reply_markup=keyboard)
+        await message.answer(catalog("ru").texts["select_language"], reply_markup=LANGUAGE_MENU)
         await state.set_state(GameStates.AGE_CONFIRM)
 
     @dp.callback_query(lambda c: c.data.startswith("lang_"))
     async def set_language(callback: types.CallbackQuery, state: FSMContext):
         logger.info(f"Language selection: {callback.data} by user {callback.from_user.id}")
         lang = callback.data.split("_")[1]
-        conn = sqlite3.connect("betsmilebot.db")
-        cursor = conn.cursor()
-        cursor.execute("UPDATE users SET language = ? WHERE telegram_id = ?", (lang, callback.from_user.id))
-        conn.commit()
-        conn.close()
+        await update_language(callback.from_user.id, lang)
         
-        keyboard = InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(text=get_text("confirm_18", lang), callback_data="confirm_18")]
-        ])
-        await callback.message.edit_text(get_text("age_confirm", lang), reply_markup=keyboard)
+        ui = catalog(lang)
+        await callback.message.edit_text(ui.texts["age_confirm"], reply_markup=ui.age_menu)
 
     @dp.callback_query(lambda c: c.data == "confirm_18")
     async def confirm_age(callback: types.CallbackQuery, state: FSMContext):
         logger.info(f"Age confirmed by user {callback.from_user.id}")
-        lang = get_user(callback.from_user.id)[1]
-        keyboard = InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(text=get_text("play", lang), callback_data="play")],
-            [InlineKeyboardButton(text=get_text("profile", lang), callback_data="profile"),
-             InlineKeyboardButton(text=get_text("deposit", lang), callback_data="deposit")],
-            [InlineKeyboardButton(text=get_text("withdraw", lang), callback_data="withdraw"),
-             InlineKeyboardButton(text=get_text("support", lang), callback_data="support")],
-            [InlineKeyboardButton(text=get_text("terms", lang), url="https://your-terms-url.com")]
-        ])
-        await callback.message.edit_text(get_text("welcome", lang), reply_markup=keyboard)
+        lang = (await get_user(callback.from_user.id))[1]
+        ui = catalog(lang)
+        await callback.message.edit_text(ui.texts["welcome"], reply_markup=ui.main_menu)
         await state.clear()
 
     @dp.callback_query(lambda c: c.data == "play")
     async def play_menu(callback: types.CallbackQuery, state: FSMContext):
         logger.info(f"Play menu accessed by user {callback.from_user.id}")
-        lang = get_user(callback.from_user.id)[1]
-        keyboard = InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(text=get_text("guess_number", lang), callback_data="game_guess_number"),
-             InlineKeyboardButton(text=get_text("coin_flip", lang), callback_data="game_coin_flip")],
-            [InlineKeyboardButton(text=get_text("find_card", lang), callback_data="game_find_card"),
-             InlineKeyboardButton(text=get_text("dice", lang), callback_data="game_dice")],
-            [InlineKeyboardButton(text=get_text("wheel", lang), callback_data="game_wheel"),
-             InlineKeyboardButton(text=get_text("back", lang), callback_data="back")]
-        ])
-        await callback.message.edit_text(get_text("choose_game", lang), reply_markup=keyboard)
+        lang = (await get_user(callback.from_user.id))[1]
+        ui = catalog(lang)
+        await callback.message.edit_text(ui.texts["choose_game"], reply_markup=ui.games_menu)
         await state.set_state(GameStates.SELECT_GAME)
 
     @dp.callback_query(lambda c: c.data.startswith("game_"))
     async def select_game(callback: types.CallbackQuery, state: FSMContext):
         logger.info(f"Game selected: {callback.data} by user {callback.from_user.id}")
-        lang = get_user(callback.from_user.id)[1]
-        game_type = callback.data.split("_")[1]
+        lang = (await get_user(callback.from_user.id))[1]
+        game_type = callback.data.removeprefix("game_")
         await state.update_data(game_type=game_type)
-        await callback.message.edit_text(get_text("enter_amount", lang))
+        await callback.message.edit_text(catalog(lang).texts["enter_amount"])
         await state.set_state(GameStates.ENTER_AMOUNT)
 
     @dp.message(GameStates.ENTER_AMOUNT)
     async def process_amount(message: types.Message, state: FSMContext):
-        user = get_user(message.from_user.id)
+        user = await get_user(message.from_user.id)
         lang = user[1]
+        ui = catalog(lang)
         logger.info(f"Amount entered: {message.text} by user {message.from_user.id}")
         try:
-            amount = float(message.text)
+            # "5" — одна ставка, "5x10" — автоигра на 10 раундов
+            amount_text, _, rounds_text = message.text.lower().replace("*", "x").partition("x")
+            amount = float(amount_text)
+            rounds = int(rounds_text) if rounds_text.strip() else 1
             if amount < 0.5 or amount > 500:
-                await message.answer(get_text("amount_range", lang))
+                await message.answer(ui.texts["amount_range"])
+                return
+            if rounds < 1 or rounds > AUTOPLAY_MAX_ROUNDS:
+                await message.answer(ui.texts["rounds_range"].format(max_rounds=AUTOPLAY_MAX_ROUNDS))
+                return
+            game_type = (await state.get_data()).get("game_type")
+            if game_type not in GAMES:
+                # Ставка пришла, когда игра уже сыграна, не выбрана или неизвестна
+                await message.answer(ui.texts["choose_game"], reply_markup=ui.games_menu)
+                await state.set_state(GameStates.SELECT_GAME)
+                return
+            if rounds > 1:
+                summary = await autoplay(user[0], game_type, amount, rounds)
+                if summary is None:
+                    await message.answer(ui.texts["insufficient_balance"])
+                    return
+                await state.clear()
+                wins, win_amount = summary
+                text = ui.texts["autoplay_summary"].format(rounds=rounds, wins=wins, net=win_amount - amount * rounds)
+                await message.answer(text, reply_markup=ui.games_menu)
                 return
-            if user[3] < amount and user[4] < amount:
-                await message.answer(get_text("insufficient_balance", lang))
+            if user[2] < amount and user[3] < amount:
+                await message.answer(ui.texts["insufficient_balance"])
                 return
-            mode = "real" if user[4] >= amount else "demo"
-            result, win_amount = play_game(user[0], mode, amount, (await state.get_data())["game_type"])
-            if mode == "demo":
-                update_balance(user[0], demo_balance=user[3] + win_amount - amount)
-            else:
-                update_balance(user[0], real_balance=user[4] + win_amount - amount)
-                if win_amount > 0 and mode == "real":
-                    conn = sqlite3.connect("betsmilebot.db")
-                    cursor = conn.cursor()
-                    cursor.execute("INSERT INTO transactions (telegram_id, amount, type, status) VALUES (?, ?, ?, ?)",
-                                  (user[0], win_amount, "win", "completed"))
-                    conn.commit()
-                    conn.close()
-            await message.answer_animation(animation=ANIMATION_GIFS[result], caption=get_text(result, lang))
-            await asyncio.sleep(2)  # Задержка для анимации
+            mode = "real" if user[3] >= amount else "demo"
+            result, win_amount = await play_game(user[0], mode, amount, game_type)
+            if result is None:
+                await message.answer(ui.texts["insufficient_balance"])
+                return
+            await state.clear()
+            sent = await message.answer_animation(animation=get_animation(result), caption=ui.texts[result])
+            await remember_animation(result, sent)
+            return
         except ValueError:
-            await message.answer(get_text("invalid_amount", lang))
+            await message.answer(ui.texts["invalid_amount"])
         await state.clear()
 
     @dp.callback_query(lambda c: c.data == "deposit")
     async def deposit(callback: types.CallbackQuery):
         logger.info(f"Deposit requested by user {callback.from_user.id}")
-        lang = get_user(callback.from_user.id)[1]
-        payment_url = create_payment(callback.from_user.id, 0.5, "USD")
+        lang = (await get_user(callback.from_user.id))[1]
+        ui = catalog(lang)
+        payment_url = await create_payment(callback.from_user.id, 0.5, "USD")
         if not payment_url:
-            await callback.message.edit_text(get_text("payment_error", lang))
+            await callback.message.edit_text(ui.texts["payment_error"])
             return
         keyboard = InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(text=get_text("pay", lang), url=payment_url)],
-            [InlineKeyboardButton(text=get_text("back", lang), callback_data="back")]
+            [InlineKeyboardButton(text=ui.texts["pay"], url=payment_url)],
+            *ui.back_menu.inline_keyboard
         ])
-        await callback.message.edit_text(get_text("deposit_info", lang), reply_markup=keyboard)
+        await callback.message.edit_text(ui.texts["deposit_info"], reply_markup=keyboard)
 
     @dp.callback_query(lambda c: c.data == "withdraw")
     async def withdraw(callback: types.CallbackQuery):
         logger.info(f"Withdraw requested by user {callback.from_user.id}")
-        user = get_user(callback.from_user.id)
+        user = await get_user(callback.from_user.id)
         lang = user[1]
-        if user[4] < 50:
-            await callback.message.edit_text(get_text("min_withdraw", lang))
+        ui = catalog(lang)
+        if user[3] < 50:
+            await callback.message.edit_text(ui.texts["min_withdraw"])
             return
-        conn = sqlite3.connect("betsmilebot.db")
-        cursor = conn.cursor()
-        cursor.execute("INSERT INTO transactions (telegram_id, amount, type, status) VALUES (?, ?, ?, ?)",
-                      (user[0], user[4], "withdraw", "pending"))
-        conn.commit()
-        conn.close()
-        keyboard = InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(text=get_text("back", lang), callback_data="back")]
-        ])
-        await callback.message.edit_text(get_text("withdraw_request", lang), reply_markup=keyboard)
+        await add_withdrawal(user[0], user[3])
+        logger.info(f"Withdrawal of {user[3]} requested by user {user[0]}",
+                    extra=audit(event="withdrawal", user_id=user[0], amount=user[3]))
+        await callback.message.edit_text(ui.texts["withdraw_request"], reply_markup=ui.back_menu)
 
     @dp.callback_query(lambda c: c.data == "profile")
-    async def profile(callback: types.CallbackQuery):
+    async def profile(callback: types.CallbackQuery, bot: Bot):
         logger.info(f"Profile accessed by user {callback.from_user.id}")
-        user = get_user(callback.from_user.id)
+        user = await get_user(callback.from_user.id)
         lang = user[1]
-        text = get_text("profile_info", lang).format(
-            demo_balance=user[3], real_balance=user[4], referral_code=user[5]
+        ui = catalog(lang)
+        me = await bot.me()
+        text = ui.texts["profile_info"].format(
+            demo_balance=user[2], real_balance=user[3],
+            referral_link=f"https://t.me/{me.username}?start={user[5]}",
+            referrals=user[9], referral_bonus=round(user[10], 2)
         )
-        keyboard = InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(text=get_text("back", lang), callback_data="back")]
-        ])
-        await callback.message.edit_text(text, reply_markup=keyboard)
+        await callback.message.edit_text(text, reply_markup=ui.back_menu)
 
     @dp.callback_query(lambda c: c.data == "support")
     async def support(callback: types.CallbackQuery):
         logger.info(f"Support accessed by user {callback.from_user.id}")
-        lang = get_user(callback.from_user.id)[1]
-        keyboard = InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(text=get_text("back", lang), callback_data="back")]
-        ])
-        await callback.message.edit_text(get_text("support_info", lang), reply_markup=keyboard)
+        lang = (await get_user(callback.from_user.id))[1]
+        ui = catalog(lang)
+        await callback.message.edit_text(ui.texts["support_info"], reply_markup=ui.back_menu)
 
     @dp.callback_query(lambda c: c.data == "back")
     async def back(callback: types.CallbackQuery, state: FSMContext):
         logger.info(f"Back button pressed by user {callback.from_user.id}")
-        lang = get_user(callback.from_user.id)[1]
-        keyboard = InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(text=get_text("play", lang), callback_data="play")],
-            [InlineKeyboardButton(text=get_text("profile", lang), callback_data="profile"),
-             InlineKeyboardButton(text=get_text("deposit", lang), callback_data="deposit")],
-            [InlineKeyboardButton(text=get_text("withdraw", lang), callback_data="withdraw"),
-             InlineKeyboardButton(text=get_text("support", lang), callback_data="support")],
-            [InlineKeyboardButton(text=get_text("terms", lang), url="https://your-terms-url.com")]
-        ])
-        await callback.message.edit_text(get_text("welcome", lang), reply_markup=keyboard)
+        lang = (await get_user(callback.from_user.id))[1]
+        ui = catalog(lang)
+        await callback.message.edit_text(ui.texts["welcome"], reply_markup=ui.main_menu)
         await state.clear()
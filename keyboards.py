@@ -0,0 +1,96 @@
+from types import MappingProxyType
+from typing import NamedTuple
+from pydantic import ConfigDict
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+from utils import TEXTS, LANGUAGES, TERMS_URL, get_text
+from odds import GAMES
+
+# Каталог собирается один раз при импорте: для каждого языка готовые тексты
+# и клавиатуры, обработчикам остаётся только выбрать нужный. Объекты общие
+# для всех пользователей, поэтому неизменяемые: тексты — MappingProxyType,
+# клавиатуры — замороженные модели со списками только для чтения.
+class _ReadOnlyList(list):
+    def _read_only(self, *args, **kwargs):
+        raise TypeError("shared keyboard is read-only")
+    append = extend = insert = remove = pop = clear = sort = reverse = _read_only
+    __setitem__ = __delitem__ = __iadd__ = __imul__ = _read_only
+
+class _FrozenButton(InlineKeyboardButton):
+    model_config = ConfigDict(frozen=True)
+
+class _FrozenMarkup(InlineKeyboardMarkup):
+    model_config = ConfigDict(frozen=True)
+
+def _freeze(rows):
+    # model_construct, чтобы валидация не заменила списки обычными;
+    # при отправке в Telegram сериализуется как обычная клавиатура
+    return _FrozenMarkup.model_construct(inline_keyboard=_ReadOnlyList(
+        _ReadOnlyList(_FrozenButton(**button.model_dump(exclude_none=True)) for button in row) for row in rows
+    ))
+
+class LanguageCatalog(NamedTuple):
+    texts: MappingProxyType
+    main_menu: InlineKeyboardMarkup
+    games_menu: InlineKeyboardMarkup
+    back_menu: InlineKeyboardMarkup
+    age_menu: InlineKeyboardMarkup
+
+def _rows(buttons, width=2):
+    return [buttons[i:i + width] for i in range(0, len(buttons), width)]
+
+def _main_menu(text):
+    return _freeze([
+        [InlineKeyboardButton(text=text("play"), callback_data="play")],
+        [InlineKeyboardButton(text=text("profile"), callback_data="profile"),
+         InlineKeyboardButton(text=text("deposit"), callback_data="deposit")],
+        [InlineKeyboardButton(text=text("withdraw"), callback_data="withdraw"),
+         InlineKeyboardButton(text=text("support"), callback_data="support")],
+        [InlineKeyboardButton(text=text("terms"), url=TERMS_URL)]
+    ])
+
+def _games_menu(text):
+    return _freeze(_rows(
+        [InlineKeyboardButton(text=text(game), callback_data=f"game_{game}") for game in GAMES]
+        + [InlineKeyboardButton(text=text("back"), callback_data="back")]
+    ))
+
+def _build(lang):
+    keys = set().union(*TEXTS.values())
+    texts = MappingProxyType({key: get_text(key, lang) for key in keys})
+    return LanguageCatalog(
+        texts=texts,
+        main_menu=_main_menu(texts.__getitem__),
+        games_menu=_games_menu(texts.__getitem__),
+        back_menu=_freeze([
+            [InlineKeyboardButton(text=texts["back"], callback_data="back")]
+        ]),
+        age_menu=_freeze([
+            [InlineKeyboardButton(text=texts["confirm_18"], callback_data="confirm_18")]
+        ]),
+    )
+
+CATALOG = MappingProxyType({lang: _build(lang) for lang in TEXTS})
+
+LANGUAGE_MENU = _freeze(_rows(
+    [InlineKeyboardButton(text=label, callback_data=f"lang_{lang}") for lang, label in LANGUAGES.items()]
+))
+
+def catalog(lang):
+    """Каталог для языка; для неизвестного языка — русский, как в get_text."""
+    return CATALOG.get(lang) or CATALOG["ru"]
+
+if __name__ == "__main__":
+    # Микробенчмарк: сборка меню на каждый запрос против выбора из каталога
+    import timeit
+
+    def rebuild(lang="en"):
+        text = lambda key: get_text(key, lang)
+        return _main_menu(text), _games_menu(text)
+
+    def lookup(lang="en"):
+        ui = catalog(lang)
+        return ui.main_menu, ui.games_menu
+
+    for name, func in (("rebuild", rebuild), ("catalog", lookup)):
+        runs, total = timeit.Timer(func).autorange()
+        print(f"{name:>8}: {total / runs * 1e6:9.2f} µs per update")
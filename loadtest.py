@@ -0,0 +1,144 @@
+"""
+Нагрузочный тест без сети: собирает настоящий Dispatcher через
+main.build_dispatcher (обработчики, FSM-хранилище и middleware), подменяет
+сессию Bot заглушкой, которая записывает исходящие вызовы, и прогоняет через
+feed_update синтетических пользователей по сценарию /start → язык → 18+ → играть →
+игра → ставка. Печатает пропускную способность и p50/p99 по обработчикам.
+База создаётся во временном каталоге, ставки идут с демо-баланса.
+
+    python loadtest.py --users 2000 --concurrency 200 --seed 1
+"""
+import argparse
+import os
+import tempfile
+
+# Настройки читаются при импорте config, поэтому окружение готовим заранее
+os.environ.setdefault("TELEGRAM_TOKEN", "123456:LOADTEST")
+os.environ.setdefault("ADMIN_ID", "0")
+os.environ["MEDIA_WARMUP_CHAT_ID"] = "0"
+
+import asyncio
+import random
+import time
+from collections import Counter, defaultdict
+from typing import Any, Awaitable, Callable, Dict
+
+def _percentile(values, q):
+    return values[min(int(len(values) * q), len(values) - 1)]
+
+async def run(users, concurrency, api_latency, game_type, amount, seed):
+    # Импорты здесь: DB_PATH должен быть выставлен до загрузки config
+    from aiogram import BaseMiddleware, Bot
+    from aiogram.client.session.base import BaseSession
+    from aiogram.methods import SendAnimation
+    from aiogram.types import Message, TelegramObject, Update
+    import database
+    from main import build_dispatcher
+
+    class RecordingSession(BaseSession):
+        """Вместо Telegram API: считает вызовы и отвечает правдоподобным результатом."""
+        def __init__(self):
+            super().__init__()
+            self.calls = Counter()
+
+        async def make_request(self, bot, method, timeout=None):
+            self.calls[type(method).__name__] += 1
+            if api_latency:
+                await asyncio.sleep(api_latency)
+            chat_id = getattr(method, "chat_id", None)
+            if chat_id is None:
+                return True
+            message = {"message_id": 1, "date": int(time.time()), "chat": {"id": chat_id, "type": "private"}}
+            if isinstance(method, SendAnimation):
+                message["animation"] = {"file_id": f"loadtest_{method.caption}", "file_unique_id": "loadtest",
+                                        "width": 1, "height": 1, "duration": 1}
+            return Message.model_validate(message, context={"bot": bot})
+
+        async def stream_content(self, *args, **kwargs):
+            yield b""
+
+        async def close(self):
+            pass
+
+    timings = defaultdict(list)
+
+    class TimingMiddleware(BaseMiddleware):
+        async def __call__(
+            self,
+            handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+            event: TelegramObject,
+            data: Dict[str, Any]
+        ) -> Any:
+            started = time.perf_counter()
+            try:
+                return await handler(event, data)
+            finally:
+                timings[data["handler"].callback.__name__].append(time.perf_counter() - started)
+
+    random.seed(seed)
+    await database.init_db()
+    session = RecordingSession()
+    bot = Bot(token=os.environ["TELEGRAM_TOKEN"], session=session)
+    dp = build_dispatcher()
+    dp.message.middleware(TimingMiddleware())
+    dp.callback_query.middleware(TimingMiddleware())
+
+    update_ids = iter(range(1, 10 ** 9))
+
+    def update(user_id, text=None, data=None):
+        sender = {"id": user_id, "is_bot": False, "first_name": f"user{user_id}", "language_code": "en"}
+        message = {"message_id": 1, "date": int(time.time()), "chat": {"id": user_id, "type": "private"},
+                   "from": sender, "text": text or "menu"}
+        if data is None:
+            return Update.model_validate({"update_id": next(update_ids), "message": message})
+        return Update.model_validate({"update_id": next(update_ids), "callback_query": {
+            "id": str(user_id), "chat_instance": "loadtest", "from": sender, "data": data, "message": message
+        }})
+
+    steps = [("/start", None), (None, "lang_en"), (None, "confirm_18"), (None, "play"),
+             (None, f"game_{game_type}"), (str(amount), None)]
+    limit = asyncio.Semaphore(concurrency)
+
+    async def player(user_id):
+        async with limit:
+            for text, data in steps:
+                await dp.feed_update(bot, update(user_id, text, data))
+
+    started = time.perf_counter()
+    await asyncio.gather(*(player(user_id) for user_id in range(1, users + 1)))
+    elapsed = time.perf_counter() - started
+
+    await dp.storage.close()
+    await database.flush_audit()
+    bets = (await database.fetchone("SELECT COUNT(*) FROM games"))[0]
+    database.close_db()
+    return elapsed, timings, session.calls, bets
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline load test for BetSmileBot handlers")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=100, help="users in flight at once")
+    parser.add_argument("--api-latency", type=float, default=0.0, help="simulated Telegram API latency, ms")
+    parser.add_argument("--game", default="coin_flip")
+    parser.add_argument("--amount", type=float, default=1.0)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ["DB_PATH"] = os.path.join(tmp, "loadtest.db")
+        elapsed, timings, calls, bets = asyncio.run(run(
+            args.users, args.concurrency, args.api_latency / 1000, args.game, args.amount, args.seed
+        ))
+
+    updates = sum(len(values) for values in timings.values())
+    print(f"{args.users} users, {updates} updates in {elapsed:.2f} s: "
+          f"{updates / elapsed:.0f} updates/s, {bets / elapsed:.0f} bets/s ({bets} bets)")
+    print(f"{'handler':<18}{'count':>8}{'p50 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for name, values in sorted(timings.items()):
+        values.sort()
+        print(f"{name:<18}{len(values):>8}{_percentile(values, 0.5) * 1000:>10.2f}"
+              f"{_percentile(values, 0.99) * 1000:>10.2f}{values[-1] * 1000:>10.2f}")
+    print("API calls: " + ", ".join(f"{name}={count}" for name, count in sorted(calls.items())))
+
+if __name__ == "__main__":
+    main()
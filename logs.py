@@ -0,0 +1,133 @@
+import contextvars
+import copy
+import json
+import logging
+import queue
+import random
+import time
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from typing import Any, Awaitable, Callable, Dict
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+from config import LOG_FILE, LOG_LEVEL, LOG_MAX_BYTES, LOG_BACKUPS, LOG_SAMPLE_RATES, LOG_SAMPLED_LOGGERS
+
+# Журнал пишется в отдельном потоке: обработчики только кладут запись
+# в очередь, форматирование в JSON и запись на диск идут в QueueListener.
+# Кто и в каком обработчике сейчас обрабатывается, хранится в contextvars
+# и добавляется к каждой записи автоматически.
+_user_id = contextvars.ContextVar("user_id", default=None)
+_handler = contextvars.ContextVar("handler", default=None)
+
+# Поля, которые можно передать через extra=..., чтобы они попали в JSON
+FIELDS = ("user_id", "handler", "latency_ms", "result", "event", "amount", "game_type")
+
+access_logger = logging.getLogger("handlers.access")
+
+def audit(**fields):
+    """extra для событий аудита (игры, выводы, платежи): они никогда не отбрасываются."""
+    return dict(fields, audit=True)
+
+class ContextFilter(logging.Filter):
+    def filter(self, record):
+        if getattr(record, "user_id", None) is None:
+            record.user_id = _user_id.get()
+        if getattr(record, "handler", None) is None:
+            record.handler = _handler.get()
+        return True
+
+class SamplingFilter(logging.Filter):
+    """
+    Пропускает долю rates[уровень] записей от логгеров sampled (и их потомков).
+    Аудит и всё, для чего доля не задана, проходит всегда.
+    """
+    def __init__(self, rates=LOG_SAMPLE_RATES, sampled=LOG_SAMPLED_LOGGERS):
+        super().__init__()
+        self.rates = rates
+        self.sampled = tuple(sampled)
+        self.dropped = 0
+
+    def filter(self, record):
+        rate = self.rates.get(record.levelname)
+        if rate is None or getattr(record, "audit", False):
+            return True
+        if not record.name.startswith(self.sampled):
+            return True
+        if random.random() < rate:
+            return True
+        self.dropped += 1
+        return False
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": self.formatTime(record, "%Y-%m-%dT%H:%M:%S") + f".{int(record.msecs):03d}",
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for field in FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        if getattr(record, "audit", False):
+            entry["audit"] = True
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        elif record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+class _QueueHandler(QueueHandler):
+    def prepare(self, record):
+        # Трассировку храним отдельным полем, а не склеиваем с сообщением
+        record = copy.copy(record)
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.msg = record.getMessage()
+        record.args = None
+        record.exc_info = None
+        return record
+
+def setup_logging():
+    """Перенаправить корневой логгер в очередь и запустить поток записи. Возвращает listener."""
+    file_handler = RotatingFileHandler(LOG_FILE, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUPS,
+                                       encoding="utf-8")
+    file_handler.setFormatter(JsonFormatter())
+    records = queue.SimpleQueue()
+    queue_handler = _QueueHandler(records)
+    queue_handler.addFilter(SamplingFilter())
+    queue_handler.addFilter(ContextFilter())
+
+    root = logging.getLogger()
+    root.handlers.clear()
+    root.addHandler(queue_handler)
+    root.setLevel(LOG_LEVEL)
+    listener = QueueListener(records, file_handler, respect_handler_level=True)
+    listener.start()
+    return listener
+
+class LogContextMiddleware(BaseMiddleware):
+    """Проставляет user_id и имя обработчика в записи журнала и пишет строку доступа с задержкой."""
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        user = data.get("event_from_user")
+        name = getattr(data["handler"].callback, "__name__", "unknown")
+        user_token = _user_id.set(user.id if user else None)
+        handler_token = _handler.set(name)
+        started = time.perf_counter()
+        result = "error"
+        try:
+            response = await handler(event, data)
+            result = "ok"
+            return response
+        finally:
+            latency_ms = round((time.perf_counter() - started) * 1000, 2)
+            level = logging.INFO if result == "ok" else logging.WARNING
+            access_logger.log(level, f"{name} {result} in {latency_ms} ms",
+                              extra={"latency_ms": latency_ms, "result": result})
+            _user_id.reset(user_token)
+            _handler.reset(handler_token)
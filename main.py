@@ -1,36 +1,57 @@
 import asyncio
 import logging
 from aiogram import Bot, Dispatcher
-from aiogram.fsm.storage.memory import MemoryStorage
-from config import TELEGRAM_TOKEN
+from aiogram.fsm.storage.memory import SimpleEventIsolation
+from config import (TELEGRAM_TOKEN, WRITE_BEHIND, MEDIA_WARMUP_CHAT_ID, BOT_MODE,
+                    METRICS_HOST, METRICS_PORT)
 from handlers import register_handlers
 from admin import register_admin_handlers
-from database import init_db
-
-# Настройка логирования
-logging.basicConfig(
-    level=logging.INFO,
-    filename="bot.log",
-    filemode="a",
-    format="%(asctime)s - %(levelname)s - %(message)s"
-)
+from database import (init_db, close_db, run_audit_writer, flush_audit, cache_stats, audit_stats,
+                      run_referral_bonuses)
+from payments import close_payments, run_reconciler
+from media import load_animations, warm_animations
+from webhook import run_webhook
+from storage import SQLiteStorage
+from middlewares import UserQueueMiddleware, ThrottlingMiddleware
+from logs import setup_logging, LogContextMiddleware
+from broadcast import resume_broadcasts, stop_broadcasts
+import metrics
 
 logger = logging.getLogger(__name__)
 
+def build_dispatcher():
+    """Dispatcher со всеми middleware и обработчиками (им же пользуется loadtest.py)."""
+    # Состояние FSM читается под блокировкой ключа: следующее обновление
+    # того же пользователя видит состояние, записанное предыдущим.
+    # Middleware FSM регистрируется ниже, после ограничения частоты
+    dp = Dispatcher(storage=SQLiteStorage(), events_isolation=SimpleEventIsolation(), disable_fsm=True)
+
+    # Ограничение частоты, затем очереди обновлений по пользователям
+    dp["throttling"] = ThrottlingMiddleware()
+    dp.update.outer_middleware(dp["throttling"])
+    dp["update_queue"] = UserQueueMiddleware()
+    dp.update.outer_middleware(dp["update_queue"])
+    # Отклонённые обновления не доходят до чтения состояния FSM из БД
+    dp.update.outer_middleware(dp.fsm)
+    # Время и ошибки каждого обработчика, контекст для журнала
+    for observer in (dp.message, dp.callback_query):
+        observer.middleware(metrics.HandlerMetricsMiddleware())
+        observer.middleware(LogContextMiddleware())
+
+    register_handlers(dp)
+    register_admin_handlers(dp)
+    return dp
+
 async def main():
     logger.info("Starting bot...")
     bot = Bot(token=TELEGRAM_TOKEN)
-    dp = Dispatcher(storage=MemoryStorage())
+    dp = build_dispatcher()
+    logger.info("Handlers registered")
     
     # Инициализация базы данных
-    init_db()
+    await init_db()
     logger.info("Database initialized")
     
-    # Регистрация обработчиков
-    register_handlers(dp)
-    register_admin_handlers(dp)
-    logger.info("Handlers registered")
-    
     # Проверка подключения
     try:
         bot_info = await bot.get_me()
@@ -39,9 +60,51 @@ async def main():
         logger.error(f"Failed to connect to Telegram API: {e}")
         return
     
+    # Кэш file_id анимаций
+    await load_animations()
+    if MEDIA_WARMUP_CHAT_ID:
+        await warm_animations(bot, MEDIA_WARMUP_CHAT_ID)
+    
+    # Метрики: состояние кэшей и очередей снимается в момент запроса /metrics;
+    # монотонные счётчики экспортируются как counter (<имя>_total), остальное — как gauge
+    metrics.register_collector(lambda: metrics.collect("bot_user_cache", cache_stats(), counters=("hits", "misses")))
+    metrics.register_collector(lambda: metrics.collect("bot_audit", audit_stats(),
+                                                       counters=("queued", "flushed", "flushes")))
+    metrics.register_collector(lambda: metrics.collect("bot_update_queue", dp["update_queue"].queue_stats(),
+                                                       counters=("processed", "coalesced", "shed")))
+    metrics.register_collector(lambda: {"bot_throttled_total": dp["throttling"].throttled})
+    metrics_runner = await metrics.start_metrics_server(METRICS_HOST, METRICS_PORT) if METRICS_PORT else None
+
     # Запуск бота
-    logger.info("Starting polling...")
-    await dp.start_polling(bot)
+    tasks = [asyncio.create_task(run_reconciler()), asyncio.create_task(metrics.monitor_loop_lag()),
+             asyncio.create_task(run_referral_bonuses())]
+    if WRITE_BEHIND:
+        tasks.append(asyncio.create_task(run_audit_writer()))
+    # Продолжить рассылки, прерванные прошлым запуском
+    await resume_broadcasts(bot)
+    try:
+        if BOT_MODE == "webhook":
+            logger.info("Starting webhook server...")
+            await run_webhook(dp, bot)
+        else:
+            logger.info("Starting polling...")
+            await dp.start_polling(bot)
+    finally:
+        await stop_broadcasts()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
+        # Сбросить в БД всё, что осталось в очереди отложенной записи
+        await flush_audit()
+        await close_payments()
+        close_db()
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    # Журнал пишется в отдельном потоке через очередь
+    listener = setup_logging()
+    try:
+        asyncio.run(main())
+    finally:
+        listener.stop()
@@ -0,0 +1,41 @@
+from aiogram import Bot, types
+from database import get_media_file_ids, save_media_file_id
+from utils import ANIMATION_GIFS
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Telegram file_id для каждой анимации: после первой отправки GIF
+# повторно отправляется по file_id, без скачивания Telegram'ом по URL
+_file_ids = {}
+
+def get_animation(key):
+    return _file_ids.get(key) or ANIMATION_GIFS[key]
+
+async def remember_animation(key, message: types.Message):
+    # file_id одного и того же файла может меняться от сообщения к сообщению,
+    # поэтому запоминаем только первый
+    media = message.animation or message.document
+    if media is None or key in _file_ids:
+        return
+    _file_ids[key] = media.file_id
+    await save_media_file_id(key, ANIMATION_GIFS[key], media.file_id)
+
+async def load_animations():
+    # file_id действителен, только пока URL анимации не поменялся
+    for key, (url, file_id) in (await get_media_file_ids()).items():
+        if ANIMATION_GIFS.get(key) == url:
+            _file_ids[key] = file_id
+    logger.info(f"Loaded {len(_file_ids)}/{len(ANIMATION_GIFS)} cached animation file_ids")
+
+async def warm_animations(bot: Bot, chat_id):
+    """Загрузить file_id для анимаций, которых ещё нет в кэше, отправив их в служебный чат."""
+    for key, url in ANIMATION_GIFS.items():
+        if key in _file_ids:
+            continue
+        try:
+            message = await bot.send_animation(chat_id, animation=url, disable_notification=True)
+            await remember_animation(key, message)
+            await bot.delete_message(chat_id, message.message_id)
+        except Exception as e:
+            logger.error(f"Failed to warm animation {key}: {e}")
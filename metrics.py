@@ -0,0 +1,183 @@
+import asyncio
+import sys
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter
+from typing import Any, Awaitable, Callable, Dict
+from aiohttp import web
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+from config import PROFILER_INTERVAL_MS
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Метрики в текстовом формате Prometheus без внешних зависимостей.
+# observe/inc вызываются и из потоков БД, поэтому всё под одной блокировкой.
+_lock = threading.Lock()
+_histograms = {}
+_counters = {}
+_gauges = {}
+_collectors = []
+
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _labels(labels):
+    return ",".join(f'{key}="{_escape(value)}"' for key, value in sorted(labels.items()))
+
+def _series(name, labels):
+    return f"{name}{{{labels}}}" if labels else name
+
+def observe(name, seconds, **labels):
+    key = (name, _labels(labels))
+    with _lock:
+        hist = _histograms.get(key)
+        if hist is None:
+            hist = _histograms[key] = [[0] * (len(BUCKETS) + 1), 0.0, 0]
+        hist[0][bisect_left(BUCKETS, seconds)] += 1
+        hist[1] += seconds
+        hist[2] += 1
+
+def inc(name, value=1, **labels):
+    key = (name, _labels(labels))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+def set_gauge(name, value, **labels):
+    with _lock:
+        _gauges[(name, _labels(labels))] = value
+
+def set_counter(name, value, **labels):
+    # Для счётчиков, которые ведёт сам компонент: значение уже накопленное
+    with _lock:
+        _counters[(name, _labels(labels))] = value
+
+def register_collector(func):
+    """
+    func() -> {имя: значение}; вызывается при каждом запросе /metrics.
+    Имена с суффиксом _total экспортируются как counter, остальные — как gauge.
+    """
+    _collectors.append(func)
+
+def collect(prefix, stats, counters=()):
+    """Словарь статистики -> метрики <prefix>_<ключ>; монотонные ключи из counters получают суффикс _total."""
+    return {f"{prefix}_{key}_total" if key in counters else f"{prefix}_{key}": value for key, value in stats.items()}
+
+def _typed(lines, kind, name, seen):
+    if name not in seen:
+        seen.add(name)
+        lines.append(f"# TYPE {name} {kind}")
+
+def render():
+    for collector in _collectors:
+        try:
+            for name, value in collector().items():
+                (set_counter if name.endswith("_total") else set_gauge)(name, value)
+        except Exception as e:
+            logger.error(f"Metrics collector {collector.__name__} failed: {e}")
+    lines, seen = [], set()
+    with _lock:
+        for (name, labels), (buckets, total, count) in sorted(_histograms.items()):
+            _typed(lines, "histogram", name, seen)
+            sep = "," if labels else ""
+            cumulative = 0
+            for bound, bucket in zip(BUCKETS + ("+Inf",), buckets):
+                cumulative += bucket
+                lines.append(f'{name}_bucket{{{labels}{sep}le="{bound}"}} {cumulative}')
+            lines.append(f"{_series(name + '_sum', labels)} {total}")
+            lines.append(f"{_series(name + '_count', labels)} {count}")
+        for (name, labels), value in sorted(_counters.items()):
+            _typed(lines, "counter", name, seen)
+            lines.append(f"{_series(name, labels)} {value}")
+        for (name, labels), value in sorted(_gauges.items()):
+            _typed(lines, "gauge", name, seen)
+            lines.append(f"{_series(name, labels)} {value}")
+    return "\n".join(lines) + "\n"
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """Время и ошибки каждого обработчика (внутренняя middleware на message/callback_query)."""
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        name = getattr(data["handler"].callback, "__name__", "unknown")
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            inc("bot_handler_errors_total", handler=name)
+            raise
+        finally:
+            observe("bot_handler_seconds", time.perf_counter() - started, handler=name)
+
+async def monitor_loop_lag(interval=0.5):
+    # Насколько позже запланированного просыпается event loop
+    while True:
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        lag = max(time.perf_counter() - started - interval, 0.0)
+        observe("bot_event_loop_lag_seconds", lag)
+        set_gauge("bot_event_loop_lag_last_seconds", lag)
+
+async def start_metrics_server(host, port):
+    async def handle(request):
+        return web.Response(text=render(), content_type="text/plain", charset="utf-8")
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info(f"Metrics available on http://{host}:{port}/metrics")
+    return runner
+
+class SamplingProfiler:
+    """
+    Статистический профайлер: фоновый поток раз в interval секунд снимает стек
+    главного потока и считает одинаковые стеки. Результат — в формате
+    collapsed stacks (flamegraph.pl, speedscope).
+    """
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.samples = Counter()
+        self._thread = None
+        self._stop = threading.Event()
+        self._target = threading.main_thread().ident
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if self.running:
+            return
+        self.samples.clear()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        return self.collapsed()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self._target)
+            stack = []
+            while frame is not None:
+                stack.append(f"{frame.f_code.co_name} ({frame.f_code.co_filename.rsplit('/', 1)[-1]})")
+                frame = frame.f_back
+            self.samples[";".join(reversed(stack))] += 1
+
+    def collapsed(self):
+        return "\n".join(f"{stack} {count}" for stack, count in self.samples.most_common())
+
+profiler = SamplingProfiler(PROFILER_INTERVAL_MS / 1000)
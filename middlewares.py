@@ -0,0 +1,186 @@
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Dict
+from aiogram import BaseMiddleware
+from aiogram.types import Update
+from config import UPDATE_WORKERS, USER_QUEUE_LIMIT, RATE_LIMITS, RATE_BUCKET_IDLE
+from database import cached_user
+from utils import get_text, LANGUAGES
+import logging
+
+logger = logging.getLogger(__name__)
+
+class UserQueueMiddleware(BaseMiddleware):
+    """
+    Обновления одного пользователя обрабатываются строго по очереди,
+    разных пользователей — параллельно, но не больше workers одновременно.
+    Повторное нажатие той же inline-кнопки, пока предыдущее ещё в очереди
+    или обрабатывается, отбрасывается; сверх queue_limit ожидающих обновлений
+    на пользователя новые тоже отбрасываются.
+    """
+    def __init__(self, workers=UPDATE_WORKERS, queue_limit=USER_QUEUE_LIMIT):
+        self.workers = asyncio.Semaphore(workers)
+        self.queue_limit = queue_limit
+        # user_id -> [lock, число обновлений в очереди и в работе, data необработанных callback]
+        self.users = {}
+        self.stats = {"processed": 0, "coalesced": 0, "shed": 0, "waiting": 0,
+                      "wait_total": 0.0, "wait_max": 0.0}
+
+    async def __call__(
+        self,
+        handler: Callable[[Update, Dict[str, Any]], Awaitable[Any]],
+        event: Update,
+        data: Dict[str, Any]
+    ) -> Any:
+        user = data.get("event_from_user")
+        if user is None:
+            async with self.workers:
+                return await handler(event, data)
+
+        queue = self.users.setdefault(user.id, [asyncio.Lock(), 0, set()])
+        callback = event.callback_query.data if event.callback_query else None
+        if callback is not None and callback in queue[2]:
+            self.stats["coalesced"] += 1
+            await self._dismiss(event)
+            return None
+        if queue[1] >= self.queue_limit:
+            self.stats["shed"] += 1
+            logger.warning(f"Update {event.update_id} from user {user.id} shed, queue is full")
+            await self._dismiss(event)
+            return None
+
+        queue[1] += 1
+        if callback is not None:
+            queue[2].add(callback)
+        self.stats["waiting"] += 1
+        arrived = time.monotonic()
+        started = False
+        try:
+            async with queue[0]:
+                async with self.workers:
+                    started = True
+                    self._record_wait(time.monotonic() - arrived)
+                    return await handler(event, data)
+        finally:
+            if not started:
+                self.stats["waiting"] -= 1
+            if callback is not None:
+                queue[2].discard(callback)
+            queue[1] -= 1
+            if queue[1] == 0:
+                del self.users[user.id]
+
+    def _record_wait(self, waited):
+        self.stats["waiting"] -= 1
+        self.stats["processed"] += 1
+        self.stats["wait_total"] += waited
+        self.stats["wait_max"] = max(self.stats["wait_max"], waited)
+
+    async def _dismiss(self, event: Update):
+        # Убираем «часики» на кнопке, чтобы пользователь не жал её снова
+        if event.callback_query:
+            try:
+                await event.callback_query.answer()
+            except Exception:
+                pass
+
+    def queue_stats(self):
+        processed = self.stats["processed"]
+        return {
+            "users": len(self.users),
+            "waiting": self.stats["waiting"],
+            "longest_queue": max((queue[1] for queue in self.users.values()), default=0),
+            "processed": processed,
+            "coalesced": self.stats["coalesced"],
+            "shed": self.stats["shed"],
+            "avg_wait_ms": self.stats["wait_total"] / processed * 1000 if processed else 0.0,
+            "max_wait_ms": self.stats["wait_max"] * 1000,
+        }
+
+ADMIN_COMMANDS = ("/admin", "/recompute_stats", "/users", "/withdrawals", "/export", "/broadcast")
+
+def action_class(event: Update):
+    if event.callback_query:
+        data = event.callback_query.data or ""
+        if data == "deposit":
+            return "deposit"
+        if data.startswith("admin_"):
+            return "admin"
+        return "navigation"
+    if event.message and event.message.text:
+        text = event.message.text
+        if not text.startswith("/"):
+            # Обычный текст принимает только process_amount — это ставка
+            return "bet"
+        if text.split()[0].split("@")[0] in ADMIN_COMMANDS:
+            return "admin"
+    return "navigation"
+
+class ThrottlingMiddleware(BaseMiddleware):
+    """
+    Token bucket на каждую пару (пользователь, класс действия): ёмкость
+    и скорость пополнения задаются в RATE_LIMITS. Отклонённое обновление
+    не доходит ни до БД, ни до платёжного API; пользователь получает одно
+    «подождите» на серию отказов.
+    """
+    def __init__(self, limits=RATE_LIMITS, idle=RATE_BUCKET_IDLE):
+        self.limits = limits
+        # Класс без своего лимита ограничивается как навигация
+        self.default = limits.get("navigation", (10.0, 2.0))
+        self.idle = idle
+        # (user_id, класс) -> [токены, время последнего пополнения, предупреждён]
+        self.buckets = {}
+        self.next_sweep = time.monotonic() + idle
+        self.throttled = 0
+
+    async def __call__(
+        self,
+        handler: Callable[[Update, Dict[str, Any]], Awaitable[Any]],
+        event: Update,
+        data: Dict[str, Any]
+    ) -> Any:
+        user = data.get("event_from_user")
+        if user is None:
+            return await handler(event, data)
+        action = action_class(event)
+        capacity, rate = self.limits.get(action, self.default)
+        now = time.monotonic()
+        if now >= self.next_sweep:
+            self._sweep(now)
+
+        bucket = self.buckets.get((user.id, action))
+        if bucket is None:
+            bucket = self.buckets[(user.id, action)] = [capacity, now, False]
+        else:
+            bucket[0] = min(capacity, bucket[0] + (now - bucket[1]) * rate)
+            bucket[1] = now
+        if bucket[0] >= 1:
+            bucket[0] -= 1
+            bucket[2] = False
+            return await handler(event, data)
+
+        self.throttled += 1
+        if not bucket[2]:
+            bucket[2] = True
+            await self._slow_down(event, user)
+        return None
+
+    def _sweep(self, now):
+        # Корзина, простоявшая дольше idle, всё равно бы пополнилась до полной
+        idle = [key for key, bucket in self.buckets.items() if now - bucket[1] > self.idle]
+        for key in idle:
+            del self.buckets[key]
+        self.next_sweep = now + self.idle
+
+    async def _slow_down(self, event: Update, user):
+        # Язык берём из кэша профилей или из Telegram, без запроса к БД
+        cached = cached_user(user.id)
+        lang = cached[1] if cached else user.language_code if user.language_code in LANGUAGES else "ru"
+        text = get_text("slow_down", lang)
+        try:
+            if event.callback_query:
+                await event.callback_query.answer(text)
+            elif event.message:
+                await event.message.answer(text)
+        except Exception as e:
+            logger.error(f"Failed to send slow down notice to user {user.id}: {e}")
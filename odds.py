@@ -0,0 +1,37 @@
+"""
+Шансы и выплаты игр. Модуль без зависимостей от БД и настроек, чтобы
+его могли импортировать и бот (games.py), и офлайн-симулятор.
+"""
+import random
+from typing import Callable, NamedTuple
+
+# В «Угадай число» кроме удачи нужно ещё совпасть с одним из GUESS_OPTIONS чисел
+GUESS_OPTIONS = 5
+# Столько первых игр игрок считается новым
+NEW_USER_GAMES = 3
+
+def win_chance(mode, is_new_user):
+    return 0.6 if is_new_user and mode == "real" else 0.75 if mode == "demo" else 0.25
+
+def guess_chance(mode, is_new_user):
+    return win_chance(mode, is_new_user) / GUESS_OPTIONS
+
+class Game(NamedTuple):
+    payout: float  # во сколько раз возвращается ставка при выигрыше
+    result: str  # ключ результата: текст (utils.TEXTS) и анимация (utils.ANIMATION_GIFS) при выигрыше
+    win_probability: Callable[[str, bool], float] = win_chance  # (mode, is_new_user) -> вероятность
+
+# Реестр игр в порядке отображения в меню. Добавить игру — значит добавить
+# строку сюда, а в utils — название (ключ игры) и текст с анимацией результата
+GAMES = {
+    "guess_number": Game(2, "win_guess_number", guess_chance),
+    "coin_flip": Game(2, "win_coin_flip"),
+    "find_card": Game(3, "win_find_card"),
+    "dice": Game(2, "win_dice"),
+    "wheel": Game(4, "win_wheel")
+}
+
+def resolve_round(game, mode, is_new_user):
+    if random.random() < game.win_probability(mode, is_new_user):
+        return game.result, game.payout
+    return "lose", 0
@@ -1,32 +1,196 @@
-import requests
+import asyncio
+import random
 import time
-from config import CRYPTOCLOUD_API_KEY, CRYPTOCLOUD_SHOP_ID
-from database import update_balance, get_user
+from uuid import uuid4
+import aiohttp
+import metrics
+from config import (CRYPTOCLOUD_API_KEY, CRYPTOCLOUD_SHOP_ID, CRYPTOCLOUD_API_URL,
+                    PAYMENT_TIMEOUT, PAYMENT_RETRIES, PAYMENT_CONCURRENCY,
+                    INVOICE_BATCH_SIZE, INVOICE_POLL_MIN, INVOICE_POLL_MAX, INVOICE_TTL)
+from database import add_invoice, get_due_invoices, next_invoice_check, settle_invoices
+from logs import audit
 import logging
 
 logger = logging.getLogger(__name__)
 
-def create_payment(telegram_id, amount, currency):
-    url = "https://api.cryptocloud.plus/v1/invoice/create"
-    headers = {
-        "Authorization": f"Token {CRYPTOCLOUD_API_KEY}",
-        "Content-Type": "application/json"
-    }
+class PaymentError(Exception):
+    pass
+
+class CircuitBreaker:
+    """
+    После failure_threshold ошибок подряд перестаёт пропускать запросы
+    на reset_timeout секунд, затем пропускает один пробный запрос.
+    """
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+
+    def allow(self):
+        if self.opened_at is None:
+            return True
+        if time.monotonic() - self.opened_at < self.reset_timeout or self.trial_in_flight:
+            return False
+        self.trial_in_flight = True
+        return True
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+
+    def release_trial(self):
+        # Пробный запрос завершился без вердикта (отмена, неожиданная
+        # ошибка) — следующий вызов allow() сможет сделать новую попытку
+        self.trial_in_flight = False
+
+    def record_failure(self):
+        self.failures += 1
+        self.trial_in_flight = False
+        if self.failures >= self.failure_threshold:
+            if self.opened_at is None:
+                logger.warning("CryptoCloud circuit breaker opened")
+            self.opened_at = time.monotonic()
+
+# Одна keep-alive сессия на весь процесс
+_session = None
+_semaphore = asyncio.Semaphore(PAYMENT_CONCURRENCY)
+breaker = CircuitBreaker()
+
+def _get_session():
+    global _session
+    if _session is None or _session.closed:
+        _session = aiohttp.ClientSession(
+            base_url=CRYPTOCLOUD_API_URL,
+            headers={"Authorization": f"Token {CRYPTOCLOUD_API_KEY}"},
+            timeout=aiohttp.ClientTimeout(total=PAYMENT_TIMEOUT),
+            connector=aiohttp.TCPConnector(limit=PAYMENT_CONCURRENCY, keepalive_timeout=60),
+        )
+    return _session
+
+async def close_payments():
+    global _session
+    if _session is not None:
+        await _session.close()
+        _session = None
+
+async def _post(path, data):
+    """
+    POST с повторами: сетевые ошибки, таймауты, 429 и 5xx повторяются
+    с экспоненциальной задержкой и джиттером, остальные ответы — нет.
+    """
+    if not breaker.allow():
+        raise PaymentError("circuit breaker is open")
+    # Пропущенный при открытом предохранителе запрос — пробный
+    trial = breaker.opened_at is not None
+    try:
+        return await _attempts(path, data)
+    finally:
+        if trial:
+            breaker.release_trial()
+
+async def _attempts(path, data):
+    for attempt in range(PAYMENT_RETRIES + 1):
+        started = time.perf_counter()
+        outcome = "error"
+        try:
+            async with _semaphore:
+                async with _get_session().post(path, json=data) as response:
+                    outcome = str(response.status)
+                    if response.status == 200:
+                        result = await response.json()
+                        breaker.record_success()
+                        return result
+                    text = await response.text()
+                    if response.status != 429 and response.status < 500:
+                        # Ошибка запроса, а не сервиса — предохранитель не трогаем
+                        breaker.record_success()
+                        raise PaymentError(f"HTTP {response.status}: {text}")
+                    error = PaymentError(f"HTTP {response.status}: {text}")
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            error = e
+        finally:
+            metrics.observe("bot_payment_request_seconds", time.perf_counter() - started,
+                            path=path, status=outcome)
+        if attempt < PAYMENT_RETRIES:
+            await asyncio.sleep(random.uniform(0, 0.5 * 2 ** attempt))
+    breaker.record_failure()
+    raise PaymentError(f"request failed after {PAYMENT_RETRIES + 1} attempts: {error!r}")
+
+async def create_payment(telegram_id, amount, currency):
+    # order_id — первичный ключ invoices: два счёта за одну секунду не должны совпасть
+    order_id = f"order_{telegram_id}_{int(time.time())}_{uuid4().hex[:12]}"
     data = {
         "shop_id": CRYPTOCLOUD_SHOP_ID,
         "amount": amount,
         "currency": currency,
-        "order_id": f"order_{telegram_id}_{int(time.time())}"
+        "order_id": order_id
     }
+    started = time.perf_counter()
     try:
-        response = requests.post(url, headers=headers, json=data)
-        if response.status_code == 200:
-            payment_url = response.json()["result"]["link"]
-            logger.info(f"Payment created for user {telegram_id}: {payment_url}")
-            return payment_url
-        else:
-            logger.error(f"Failed to create payment for user {telegram_id}: {response.text}")
-            return None
+        response = await _post("/v1/invoice/create", data)
+        payment_url = response["result"]["link"]
+        await add_invoice(order_id, response["result"].get("uuid"), telegram_id, amount, currency,
+                          time.time() + INVOICE_POLL_MIN)
+        _invoice_added.set()
+        logger.info(f"Payment created for user {telegram_id}: {payment_url}",
+                    extra=audit(event="invoice", user_id=telegram_id, amount=amount))
+        metrics.observe("bot_payment_create_seconds", time.perf_counter() - started, outcome="ok")
+        return payment_url
+    except PaymentError as e:
+        logger.error(f"Failed to create payment for user {telegram_id}: {e}")
     except Exception as e:
         logger.error(f"Error creating payment for user {telegram_id}: {e}")
-        return None
+    metrics.observe("bot_payment_create_seconds", time.perf_counter() - started, outcome="failed")
+    return None
+
+# Сверка счетов: открытые счета проверяются пачками, у каждого своё время
+# следующей проверки, которое отодвигается экспоненциально (до INVOICE_POLL_MAX)
+_invoice_added = asyncio.Event()
+
+async def reconcile_invoices():
+    """Проверить одну пачку счетов, у которых подошло время. Возвращает размер пачки."""
+    now = time.time()
+    due = await get_due_invoices(now, INVOICE_BATCH_SIZE)
+    if not due:
+        return 0
+    response = await _post("/v2/invoice/merchant/info", {"uuids": [row[1] for row in due]})
+    statuses = {item["uuid"]: item["status"] for item in response.get("result", [])}
+
+    paid, closed, rescheduled = [], [], []
+    for order_id, uuid, telegram_id, amount, checks, created_at in due:
+        status = statuses.get(uuid)
+        if status in ("paid", "overpaid"):
+            paid.append((order_id, telegram_id, amount))
+        elif status == "canceled":
+            closed.append(("canceled", order_id))
+        elif now - created_at > INVOICE_TTL:
+            closed.append(("expired", order_id))
+        else:
+            rescheduled.append((now + min(INVOICE_POLL_MIN * 2 ** checks, INVOICE_POLL_MAX), order_id))
+
+    credited = await settle_invoices(paid, closed, rescheduled)
+    for telegram_id in credited:
+        logger.info(f"Deposit credited for user {telegram_id}", extra=audit(event="deposit", user_id=telegram_id))
+    return len(due)
+
+async def run_reconciler():
+    logger.info("Invoice reconciler started")
+    while True:
+        _invoice_added.clear()
+        try:
+            if await reconcile_invoices() >= INVOICE_BATCH_SIZE:
+                # Пачка заполнена целиком — скорее всего, есть ещё просроченные
+                await asyncio.sleep(0)
+                continue
+            next_at = await next_invoice_check()
+            delay = INVOICE_POLL_MAX if next_at is None else min(max(next_at - time.time(), 0), INVOICE_POLL_MAX)
+        except Exception as e:
+            logger.error(f"Invoice reconciliation failed: {e}")
+            delay = INVOICE_POLL_MIN
+        try:
+            await asyncio.wait_for(_invoice_added.wait(), delay)
+        except asyncio.TimeoutError:
+            pass
@@ -0,0 +1,64 @@
+"""
+Монте-Карло симулятор отдачи игр (RTP) на том же реестре odds.GAMES
+(выплаты и вероятности выигрыша), что и play_game. Для каждой игры и режима
+моделирует сессии игроков со ставкой 1 и печатает RTP, дисперсию выигрыша
+за раунд и распределение максимальной просадки банкролла за сессию.
+
+    python simulator.py --rounds 5000000 --session 1000
+"""
+import argparse
+import numpy as np
+from odds import GAMES, NEW_USER_GAMES
+
+def simulate(game_type, mode, rounds, session, rng, new_players=True, chunk=1_000_000):
+    """
+    Возвращает словарь с RTP, дисперсией чистого результата за раунд
+    и перцентилями максимальной просадки за сессию (в ставках).
+    Если new_players, первые NEW_USER_GAMES раундов сессии идут с шансом нового игрока.
+    """
+    game = GAMES[game_type]
+    chances = np.full(session, game.win_probability(mode, False))
+    if new_players:
+        chances[:NEW_USER_GAMES] = game.win_probability(mode, True)
+
+    sessions = max(rounds // session, 1)
+    per_chunk = max(chunk // session, 1)
+    total = total_sq = 0.0
+    drawdowns = []
+    for start in range(0, sessions, per_chunk):
+        count = min(per_chunk, sessions - start)
+        wins = rng.random((count, session)) < chances
+        net = np.where(wins, game.payout - 1.0, -1.0)
+        total += net.sum()
+        total_sq += np.square(net).sum()
+        bankroll = np.cumsum(net, axis=1)
+        peak = np.maximum.accumulate(np.maximum(bankroll, 0), axis=1)
+        drawdowns.append((peak - bankroll).max(axis=1))
+
+    n = sessions * session
+    mean = total / n
+    drawdowns = np.concatenate(drawdowns)
+    return {
+        "rtp": 1 + mean,
+        "variance": total_sq / n - mean ** 2,
+        "drawdown": dict(zip((50, 90, 99), np.percentile(drawdowns, (50, 90, 99)))),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="RTP simulator for BetSmileBot games")
+    parser.add_argument("--rounds", type=int, default=1_000_000, help="rounds per game and mode")
+    parser.add_argument("--session", type=int, default=1000, help="rounds per player session")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    print(f"{'game':<14}{'mode':<6}{'RTP':>8}{'var':>9}{'DD p50':>9}{'DD p90':>9}{'DD p99':>9}")
+    for game_type in GAMES:
+        for mode in ("demo", "real"):
+            stats = simulate(game_type, mode, args.rounds, args.session, rng)
+            dd = stats["drawdown"]
+            print(f"{game_type:<14}{mode:<6}{stats['rtp']:>8.2%}{stats['variance']:>9.3f}"
+                  f"{dd[50]:>9.1f}{dd[90]:>9.1f}{dd[99]:>9.1f}")
+
+if __name__ == "__main__":
+    main()
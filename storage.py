@@ -0,0 +1,134 @@
+import asyncio
+import json
+import time
+from typing import Any, Dict, Optional
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StorageKey, StateType
+from database import transaction, read
+from config import FSM_CACHE_TTL, FSM_STATE_TTL, FSM_FLUSH_MS
+import logging
+
+logger = logging.getLogger(__name__)
+
+def _key(key: StorageKey):
+    return f"{key.bot_id}:{key.chat_id}:{key.user_id}:{key.thread_id or ''}:{key.destiny}"
+
+def _load(conn, key, min_updated_at):
+    return conn.execute("SELECT state, data FROM fsm WHERE key = ? AND updated_at >= ?",
+                        (key, min_updated_at)).fetchone()
+
+def _flush(conn, upserts, deletes):
+    conn.executemany("""
+        INSERT INTO fsm (key, state, data, updated_at) VALUES (?, ?, ?, ?)
+        ON CONFLICT (key) DO UPDATE SET state = excluded.state, data = excluded.data, updated_at = excluded.updated_at
+    """, upserts)
+    conn.executemany("DELETE FROM fsm WHERE key = ?", deletes)
+
+def _purge(conn, min_updated_at):
+    return conn.execute("DELETE FROM fsm WHERE updated_at < ?", (min_updated_at,)).rowcount
+
+class SQLiteStorage(BaseStorage):
+    """
+    FSM-хранилище в таблице fsm базы бота, переживает перезапуск.
+    Прочитанные и записанные состояния держатся в памяти FSM_CACHE_TTL секунд,
+    изменения копятся и пишутся пачкой раз в FSM_FLUSH_MS. Состояния, не
+    менявшиеся дольше FSM_STATE_TTL, считаются устаревшими и удаляются.
+    Если БД общая для нескольких процессов (режим webhook), по умолчанию
+    FSM_CACHE_TTL и FSM_FLUSH_MS равны 0: каждое чтение идёт в БД, каждое
+    изменение записывается до возврата из set_state/set_data.
+    """
+    def __init__(self):
+        self._cache = {}
+        self._dirty = set()
+        self._flusher = None
+        self._last_purge = 0.0
+
+    async def _entry(self, key: StorageKey):
+        name = _key(key)
+        entry = self._cache.get(name)
+        now = time.time()
+        if entry is not None and (name in self._dirty or entry["cached_at"] > now - FSM_CACHE_TTL):
+            return entry
+        row = await read(_load, name, now - FSM_STATE_TTL)
+        # Пока читали, запись могла уже поменяться в памяти
+        if name in self._dirty:
+            return self._cache[name]
+        entry = {"state": row[0] if row else None, "data": json.loads(row[1]) if row else {},
+                 "cached_at": now}
+        self._cache[name] = entry
+        return entry
+
+    async def _touch(self, key: StorageKey, entry):
+        name = _key(key)
+        entry["cached_at"] = time.time()
+        self._cache[name] = entry
+        self._dirty.add(name)
+        if FSM_FLUSH_MS <= 0:
+            await self.flush()
+        elif self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.create_task(self._run_flusher())
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        entry = await self._entry(key)
+        entry["state"] = state.state if isinstance(state, State) else state
+        await self._touch(key, entry)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return (await self._entry(key))["state"]
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        entry = await self._entry(key)
+        entry["data"] = data.copy()
+        await self._touch(key, entry)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        return (await self._entry(key))["data"].copy()
+
+    async def flush(self):
+        if not self._dirty:
+            return
+        names, self._dirty = self._dirty, set()
+        now = time.time()
+        upserts, deletes = [], []
+        for name in names:
+            entry = self._cache[name]
+            if entry["state"] is None and not entry["data"]:
+                deletes.append((name,))
+            else:
+                upserts.append((name, entry["state"], json.dumps(entry["data"]), now))
+        # При отмене (close() посреди записи) дожидаемся начатой записи,
+        # а ключи возвращаем в _dirty, только если она не удалась
+        write = asyncio.ensure_future(transaction(_flush, upserts, deletes))
+        try:
+            await asyncio.shield(write)
+        except asyncio.CancelledError:
+            try:
+                await write
+            except Exception:
+                self._dirty |= names
+            raise
+        except Exception as e:
+            self._dirty |= names
+            logger.error(f"FSM flush of {len(names)} keys failed: {e}")
+            return
+        if now - self._last_purge > FSM_STATE_TTL / 24:
+            self._last_purge = now
+            purged = await transaction(_purge, now - FSM_STATE_TTL)
+            if purged:
+                logger.info(f"Purged {purged} stale FSM states")
+        # Кэш не должен расти бесконечно: выбрасываем чистые устаревшие записи
+        expired = [name for name, entry in self._cache.items()
+                   if name not in self._dirty and entry["cached_at"] < now - FSM_CACHE_TTL]
+        for name in expired:
+            del self._cache[name]
+
+    async def _run_flusher(self):
+        while self._dirty:
+            await asyncio.sleep(FSM_FLUSH_MS / 1000)
+            await self.flush()
+
+    async def close(self) -> None:
+        if self._flusher is not None:
+            self._flusher.cancel()
+            await asyncio.gather(self._flusher, return_exceptions=True)
+        await self.flush()
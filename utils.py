@@ -8,6 +8,14 @@ ANIMATION_GIFS = {
     "lose": "https://media1.tenor.com/m/J6zJ1Xq5f5IAAAAC/sad-lose.gif"  # Анимация проигрыша
 }
 
+# Языки интерфейса и подписи кнопок выбора языка
+LANGUAGES = {
+    "ru": "🇷🇺 Русский",
+    "en": "🇬🇧 English"
+}
+
+TERMS_URL = "https://your-terms-url.com"
+
 # Тексты на русском и английском языках
 TEXTS = {
     "ru": {
@@ -28,10 +36,12 @@ TEXTS = {
         "dice": "🎲 Кубик",
         "wheel": "🎡 Колесо удачи",
         "back": "🔙 Назад",
-        "enter_amount": "💸 Введите сумму (0.5–500$):",
+        "enter_amount": "💸 Введите сумму (0.5–500$):\nДля автоигры укажите сумму и число раундов, например 5x10",
         "amount_range": "❌ Сумма должна быть от 0.5 до 500$!",
         "insufficient_balance": "⚠️ Недостаточно средств на балансе!",
         "invalid_amount": "❌ Некорректная сумма! Введите число.",
+        "rounds_range": "❌ Число раундов должно быть от 1 до {max_rounds}!",
+        "autoplay_summary": "🔁 Автоигра: {rounds} раундов, побед: {wins}\n💰 Итог: {net:+.2f}$",
         "win_guess_number": "🎉 Победа! Вы угадали число! 🏆",
         "win_coin_flip": "🎉 Победа! Орёл/решка угаданы! 🪙",
         "win_find_card": "🎉 Победа! Карта найдена! 🃏",
@@ -43,8 +53,9 @@ TEXTS = {
         "payment_error": "⚠️ Ошибка при создании платежа! Попробуйте позже.",
         "withdraw_request": "✅ Заявка на вывод создана. Ожидайте подтверждения от админа.",
         "min_withdraw": "⚠️ Минимальная сумма для вывода — $50!",
-        "profile_info": "👤 Профиль\n💎 Демо-баланс: ${demo_balance}\n💰 Реальный баланс: ${real_balance}\n🔗 Реферальный код: {referral_code}",
-        "support_info": "📧 Свяжитесь с поддержкой: @BetSmileSupport"
+        "profile_info": "👤 Профиль\n💎 Демо-баланс: ${demo_balance}\n💰 Реальный баланс: ${real_balance}\n🔗 Реферальная ссылка: {referral_link}\n👥 Приглашено: {referrals}\n🎁 Реферальные бонусы: ${referral_bonus}",
+        "support_info": "📧 Свяжитесь с поддержкой: @BetSmileSupport",
+        "slow_down": "⏳ Слишком часто! Подождите немного и попробуйте снова."
     },
     "en": {
         "select_language": "🌍 Select language:",
@@ -64,10 +75,12 @@ TEXTS = {
         "dice": "🎲 Dice",
         "wheel": "🎡 Wheel of Fortune",
         "back": "🔙 Back",
-        "enter_amount": "💸 Enter amount ($0.5–$500):",
+        "enter_amount": "💸 Enter amount ($0.5–$500):\nFor autoplay, enter amount and number of rounds, e.g. 5x10",
         "amount_range": "❌ Amount must be between $0.5 and $500!",
         "insufficient_balance": "⚠️ Insufficient balance!",
         "invalid_amount": "❌ Invalid amount! Enter a number.",
+        "rounds_range": "❌ Number of rounds must be between 1 and {max_rounds}!",
+        "autoplay_summary": "🔁 Autoplay: {rounds} rounds, wins: {wins}\n💰 Result: {net:+.2f}$",
         "win_guess_number": "🎉 Win! You guessed the number! 🏆",
         "win_coin_flip": "🎉 Win! Coin flip guessed correctly! 🪙",
         "win_find_card": "🎉 Win! Card found! 🃏",
@@ -79,8 +92,9 @@ TEXTS = {
         "payment_error": "⚠️ Error creating payment! Try again later.",
         "withdraw_request": "✅ Withdrawal request created. Await admin confirmation.",
         "min_withdraw": "⚠️ Minimum withdrawal amount is $50!",
-        "profile_info": "👤 Profile\n💎 Demo Balance: ${demo_balance}\n💰 Real Balance: ${real_balance}\n🔗 Referral Code: {referral_code}",
-        "support_info": "📧 Contact support: @BetSmileSupport"
+        "profile_info": "👤 Profile\n💎 Demo Balance: ${demo_balance}\n💰 Real Balance: ${real_balance}\n🔗 Referral Link: {referral_link}\n👥 Invited: {referrals}\n🎁 Referral Bonuses: ${referral_bonus}",
+        "support_info": "📧 Contact support: @BetSmileSupport",
+        "slow_down": "⏳ Too fast! Please wait a moment and try again."
     }
 }
 
@@ -0,0 +1,86 @@
+import asyncio
+import signal
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from config import (WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_SECRET, WEBHOOK_HOST, WEBHOOK_PORT,
+                    WEBHOOK_MAX_IN_FLIGHT, WEBHOOK_DRAIN_TIMEOUT)
+import logging
+
+logger = logging.getLogger(__name__)
+
+def build_app(dp: Dispatcher, bot: Bot):
+    """
+    aiohttp-приложение, принимающее обновления Telegram на WEBHOOK_PATH.
+    Обновление обрабатывается до ответа, поэтому число одновременных запросов
+    равно числу обрабатываемых обновлений; сверх WEBHOOK_MAX_IN_FLIGHT
+    отвечаем 503, и Telegram (или балансировщик) повторит доставку.
+    """
+    # Без секрета SimpleRequestHandler принимает любой POST, и кто угодно,
+    # кто достучится до порта, может прислать обновление «от» админа
+    if not WEBHOOK_SECRET:
+        raise RuntimeError("WEBHOOK_SECRET must be set when BOT_MODE=webhook")
+    app = web.Application()
+    app["in_flight"] = 0
+    app["draining"] = False
+    app["idle"] = asyncio.Event()
+    app["idle"].set()
+
+    @web.middleware
+    async def limit_in_flight(request, handler):
+        if request.path != WEBHOOK_PATH:
+            return await handler(request)
+        if app["draining"] or app["in_flight"] >= WEBHOOK_MAX_IN_FLIGHT:
+            return web.Response(status=503, text="Busy")
+        app["in_flight"] += 1
+        app["idle"].clear()
+        try:
+            return await handler(request)
+        finally:
+            app["in_flight"] -= 1
+            if app["in_flight"] == 0:
+                app["idle"].set()
+
+    async def health(request):
+        # Балансировщик перестаёт слать запросы на инстанс, который завершается
+        if app["draining"]:
+            return web.Response(status=503, text="draining")
+        return web.Response(text="ok")
+
+    app.middlewares.append(limit_in_flight)
+    app.router.add_get("/healthz", health)
+    SimpleRequestHandler(dp, bot, handle_in_background=False, secret_token=WEBHOOK_SECRET).register(app, path=WEBHOOK_PATH)
+    setup_application(app, dp, bot=bot)
+    return app
+
+async def drain(app):
+    app["draining"] = True
+    try:
+        await asyncio.wait_for(app["idle"].wait(), WEBHOOK_DRAIN_TIMEOUT)
+    except asyncio.TimeoutError:
+        logger.warning(f"Drain timed out with {app['in_flight']} updates in flight")
+
+async def run_webhook(dp: Dispatcher, bot: Bot):
+    app = build_app(dp, bot)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT)
+    await site.start()
+    # За балансировщиком webhook регистрирует один инстанс, остальные запускаются без WEBHOOK_URL
+    if WEBHOOK_URL:
+        await bot.set_webhook(WEBHOOK_URL + WEBHOOK_PATH, secret_token=WEBHOOK_SECRET,
+                              max_connections=WEBHOOK_MAX_IN_FLIGHT,
+                              allowed_updates=dp.resolve_used_update_types())
+    logger.info(f"Webhook server listening on {WEBHOOK_HOST}:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    try:
+        await stop.wait()
+    finally:
+        logger.info("Draining webhook updates...")
+        await drain(app)
+        await runner.cleanup()
+        logger.info("Webhook server stopped")